@@ -1,14 +1,24 @@
+import json
 import os
+import queue
 import shutil
 import subprocess
 import sys
-from PyQt6.QtCore import Qt, QTimer, QPropertyAnimation, QEvent, QFile
+import threading
+import worker
+from PyQt6.QtCore import (
+    Qt, QTimer, QPropertyAnimation, QEvent, QFile, QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+)
 from PyQt6.QtGui import QFont, QColor, QPalette, QKeySequence, QImageReader, QPixmap
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QLabel, QVBoxLayout, QHBoxLayout,
-    QPushButton, QWidget, QFileDialog, QTextEdit, QComboBox, QScrollArea
+    QPushButton, QWidget, QFileDialog, QTextEdit, QComboBox, QScrollArea, QProgressBar
 )
 
+# Seconds a cancelled one-shot extraction gets to stop on its own before it is killed
+LOCAL_CANCEL_TIMEOUT = 60
+
+
 class StartupAnimation(QWidget):
     def __init__(self):
         super().__init__()
@@ -58,6 +68,113 @@ class StartupAnimation(QWidget):
 
         QTimer.singleShot(1000, self.close)  
 
+class CopySignals(QObject):
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+
+
+class CopyTask(QRunnable):
+    # Copies an uploaded file on the thread pool so large files do not freeze the window
+    def __init__(self, source, destination):
+        super().__init__()
+        self.source = source
+        self.destination = destination
+        self.signals = CopySignals()
+
+    def run(self):
+        try:
+            shutil.copy(self.source, self.destination)
+        except OSError as e:
+            self.signals.failed.emit(self.destination, str(e))
+            return
+        self.signals.finished.emit(self.destination)
+
+
+class JobThread(QThread):
+    progress = pyqtSignal(dict)
+    completed = pyqtSignal(list)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        self.cancel_requested.set()
+
+    def run(self):
+        response = worker.submit_job(self.data, on_event=self.progress.emit,
+                                     should_cancel=self.cancel_requested.is_set)
+        if response is None:
+            # No resident worker running, fall back to a one-shot extraction
+            self.run_local()
+        elif response.get("cancelled"):
+            self.cancelled.emit()
+        elif response.get("ok"):
+            self.completed.emit(response["results"])
+        else:
+            self.failed.emit(response.get("error", "Unknown error"))
+
+    def run_local(self):
+        # The job goes on the first stdin line; stdin stays open so a later line can cancel it
+        process = subprocess.Popen(
+            [sys.executable, "extract.py", "--local", "--progress", "--stdin-control"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        process.stdin.write(str(self.data) + "\n")
+        process.stdin.flush()
+
+        lines = queue.Queue()
+
+        def read_output():
+            for line in process.stdout:
+                lines.put(line)
+            lines.put(None)
+
+        threading.Thread(target=read_output, daemon=True).start()
+
+        output = []
+        while True:
+            if self.cancel_requested.is_set():
+                self.stop_local(process)
+                self.cancelled.emit()
+                return
+            try:
+                line = lines.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if line is None:
+                break
+            if line.startswith("{"):
+                self.progress.emit(json.loads(line))
+            else:
+                output.append(line.rstrip("\n"))
+
+        process.stdin.close()
+        if process.wait() != 0 or any(line.startswith("Error:") for line in output):
+            self.failed.emit("\n".join(output) or f"extract.py exited with code {process.returncode}")
+        else:
+            self.completed.emit([])
+
+
+    def stop_local(self, process):
+        # The child stops at its next progress event, rolling back the file it was ingesting and exiting
+        # without saving, so the index on disk stays as it was. Killing it is only the last resort: a kill
+        # that lands during the index save can leave chunk files from this run next to the old manifest.
+        try:
+            process.stdin.write("cancel\n")
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=LOCAL_CANCEL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
 class HomePage(QWidget):
     def __init__(self):
         super().__init__()
@@ -139,17 +256,35 @@ class HomePage(QWidget):
         style_section.addWidget(self.style_dropdown)
         style_section.addWidget(style_note)
 
+        # Progress Section
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setStyleSheet("background-color: #333333; color: white; border-radius: 5px;")
+        self.progress_bar.hide()
+
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("font-size: 12px; color: #bbbbbb;")
+
         # Footer
-        next_button = QPushButton("Next")
-        next_button.setStyleSheet(
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setStyleSheet(
+            "background-color: #444444; color: white; font-size: 16px; padding: 10px; border-radius: 10px;"
+        )
+        self.cancel_button.setFixedSize(100, 40)
+        self.cancel_button.clicked.connect(self.cancel_job)
+        self.cancel_button.hide()
+
+        self.next_button = QPushButton("Next")
+        self.next_button.setStyleSheet(
             "background-color: #1e90ff; color: white; font-size: 16px; padding: 10px; border-radius: 10px;"
         )
-        next_button.setFixedSize(100, 40)
-        next_button.clicked.connect(self.on_next_button_click)
+        self.next_button.setFixedSize(100, 40)
+        self.next_button.clicked.connect(self.on_next_button_click)
 
         footer_layout = QHBoxLayout()
+        footer_layout.addWidget(self.status_label)
         footer_layout.addStretch()
-        footer_layout.addWidget(next_button)
+        footer_layout.addWidget(self.cancel_button)
+        footer_layout.addWidget(self.next_button)
 
         # Main layout
         main_layout = QVBoxLayout()
@@ -161,11 +296,18 @@ class HomePage(QWidget):
         main_layout.addSpacing(20)
         main_layout.addLayout(style_section)
         main_layout.addStretch()
+        main_layout.addWidget(self.progress_bar)
         main_layout.addLayout(footer_layout)
 
         self.setLayout(main_layout)
 
         self.style = "Formal"   #default
+        self.thread_pool = QThreadPool.globalInstance()
+        self.pending_copies = set()
+        self.copy_tasks = []
+        self.job = None
+        self.job_files = 0
+        self.files_done = 0
 
     def load_file_preview(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "Choose File")
@@ -184,7 +326,24 @@ class HomePage(QWidget):
         file_name = os.path.basename(file_path)
         destination = os.path.join('user_files', file_name)
 
-        shutil.copy(file_path, destination)  
+        task = CopyTask(file_path, destination)
+        task.signals.finished.connect(self.on_copy_finished)
+        task.signals.failed.connect(self.on_copy_failed)
+        # Keep a reference so the signals object outlives the runnable
+        self.copy_tasks.append(task)
+        self.pending_copies.add(destination)
+        self.status_label.setText(f"Copying {file_name}...")
+        self.thread_pool.start(task)
+
+    def on_copy_finished(self, destination):
+        self.pending_copies.discard(destination)
+        self.copy_tasks = [task for task in self.copy_tasks if task.destination in self.pending_copies]
+        if not self.pending_copies and self.job is None:
+            self.status_label.clear()
+
+    def on_copy_failed(self, destination, error):
+        self.on_copy_finished(destination)
+        self.doc_error_label.setText(f"Could not copy {os.path.basename(destination)}: {error}")
 
     def adjust_question_box_height(self):
         document = self.question_text_box.document()
@@ -209,17 +368,90 @@ class HomePage(QWidget):
 
         self.style = self.style_dropdown.currentText() if self.style_dropdown.currentText() else "Formal"
 
+        if self.pending_copies:
+            self.doc_error_label.setText("Please wait for the documents to finish copying.")
+            is_valid = False
+
         if is_valid:
-            uploaded_files = [os.path.join('user_files', f) for f in os.listdir('user_files')]
+            # Absolute paths, since the resident worker resolves them from its own directory
+            uploaded_files = [os.path.abspath(os.path.join('user_files', f)) for f in os.listdir('user_files')]
             data = {
                 "uploaded_files": uploaded_files,
                 "questions": questions,
-                "style": self.style
+                "style": self.style,
+                "report_dir": os.getcwd()
             }
-            subprocess.run(["python", "extract.py"], input=str(data), text=True)
+            self.start_job(data)
         else:
             print("Please complete all fields.")
 
+    def start_job(self, data):
+        self.job_files = len(data["uploaded_files"])
+        self.files_done = 0
+        self.job = JobThread(data)
+        self.job.progress.connect(self.on_job_progress)
+        self.job.completed.connect(self.on_job_completed)
+        self.job.failed.connect(self.on_job_failed)
+        self.job.cancelled.connect(self.on_job_cancelled)
+        self.job.finished.connect(self.on_job_finished)
+
+        self.next_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.show()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.status_label.setText("Starting...")
+        self.job.start()
+
+    def cancel_job(self):
+        if self.job is not None:
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+            self.job.cancel()
+
+    def stop_job(self):
+        # A QThread destroyed while running aborts the process, and a one-shot child would outlive the window
+        if self.job is not None:
+            self.job.cancel()
+            self.job.wait()
+
+    def on_job_progress(self, event):
+        kind = event.get("event")
+        if kind == "ingest_start":
+            self.job_files = event["files"]
+            self.progress_bar.setRange(0, max(self.job_files, 1))
+            self.progress_bar.setValue(0)
+        elif kind == "file_start":
+            self.status_label.setText(f"Reading {os.path.basename(event['file'])}...")
+        elif kind == "chunk_batch":
+            self.status_label.setText(f"Indexing {os.path.basename(event['file'])}: {event['chunks']} chunks")
+        elif kind == "file_done":
+            self.files_done += 1
+            self.progress_bar.setValue(self.files_done)
+        elif kind == "questions_start":
+            self.progress_bar.setRange(0, max(event["questions"], 1))
+            self.progress_bar.setValue(0)
+            self.status_label.setText("Answering questions...")
+        elif kind == "question":
+            self.progress_bar.setValue(event["done"])
+            self.status_label.setText(f"Answered {event['done']} of {event['total']} questions")
+
+    def on_job_completed(self, results):
+        self.status_label.setText("Done")
+
+    def on_job_failed(self, error):
+        self.status_label.setText("Failed")
+        print(f"Error: {error}")
+
+    def on_job_cancelled(self):
+        self.status_label.setText("Cancelled")
+
+    def on_job_finished(self):
+        self.job = None
+        self.progress_bar.hide()
+        self.cancel_button.hide()
+        self.next_button.setEnabled(True)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -236,6 +468,10 @@ class MainWindow(QMainWindow):
     def show_home(self):
         self.setCentralWidget(self.home_page)
 
+    def closeEvent(self, event):
+        self.home_page.stop_job()
+        event.accept()
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
 
@@ -254,6 +490,17 @@ if __name__ == "__main__":
     app.setPalette(dark_palette)
     app.setStyle("Fusion")
 
+    # Start loading the models in the background while the startup animation plays. Looking for a running
+    # worker can wait on one that is busy, so it happens off the UI thread.
+    started_workers = []
+    threading.Thread(target=lambda: started_workers.append(worker.start_worker()), daemon=True).start()
+
+    def stop_started_worker():
+        if any(process is not None for process in started_workers):
+            worker.shutdown(timeout=worker.CONNECT_TIMEOUT)
+
+    app.aboutToQuit.connect(stop_started_worker)
+
     window = MainWindow()
     window.show()
     sys.exit(app.exec())
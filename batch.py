@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set
+
+from extract import QUERY_BATCH_SIZE, batched
+from generate import numpy_serializer
+from metrics import metrics
+
+# The shared index is written to disk after this many finished jobs, and once more at the end
+SAVE_EVERY_JOBS = 50
+
+logger = logging.getLogger(__name__)
+
+
+class ReadWriteLock:
+    # Any number of concurrent queries, or one ingest at a time. A waiting writer holds back new readers
+    # so ingest is not starved by a steady stream of queries.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+
+def read_jobs(path: str) -> Iterator[Dict]:
+    # One JSON object per line: {"id", "uploaded_files", "questions"}. Lines that cannot be parsed become
+    # jobs carrying only an error so they still get a result record.
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                yield {"id": f"line-{line_number}", "error": f"Invalid job on line {line_number}: {e}"}
+                continue
+            job.setdefault("id", f"line-{line_number}")
+            yield job
+
+
+def completed_job_ids(path: str) -> Set:
+    # Cuts off a record left half written by an interrupted run, then collects the ids that succeeded
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as file:
+        data = file.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            file.truncate(end)
+
+    done = set()
+    for line_number, line in enumerate(data[:end].decode('utf-8', errors='replace').splitlines(), 1):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            # The job is simply run again
+            logger.warning(f"Ignoring unreadable record on line {line_number} of {path}")
+            continue
+        if record.get("ok") and "id" in record:
+            done.add(record["id"])
+    return done
+
+
+class ResultWriter:
+    def __init__(self, path: str, append: bool):
+        self.file = open(path, "a" if append else "w", encoding='utf-8')
+        self.count = 0
+
+    def write(self, record: Dict):
+        self.file.write(json.dumps(record, default=numpy_serializer) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+
+class BatchRunner:
+    # Runs many jobs against one loaded AdvancedDocumentQA. All jobs share its index: each document is
+    # synced once per run, and a job's questions only see chunks of that job's own documents.
+    def __init__(self, qa_system, top_k: int = 5):
+        self.qa_system = qa_system
+        self.top_k = top_k
+        self.lock = ReadWriteLock()
+        self.synced = set()
+        self.synced_lock = threading.Lock()
+
+    def sync(self, file_paths) -> Dict[str, str]:
+        # Returns the documents that could not be indexed, with the reason. They are not marked as
+        # synced, so a later job naming them tries again.
+        with self.synced_lock:
+            pending = [path for path in dict.fromkeys(file_paths) if path not in self.synced]
+        if not pending:
+            return {}
+        errors = {}
+
+        def record_error(event: Dict):
+            if event.get("event") == "file_done" and "error" in event:
+                errors[event["file"]] = event["error"]
+
+        with self.lock.write(), metrics.stage("ingest", files=len(pending)):
+            # Another job may have synced some of these while this one waited for the lock
+            with self.synced_lock:
+                pending = [path for path in pending if path not in self.synced]
+            if pending:
+                self.qa_system.progress = record_error
+                try:
+                    self.qa_system.sync_documents(pending, prune=False, save=False)
+                finally:
+                    self.qa_system.progress = None
+            with self.synced_lock:
+                self.synced.update(path for path in pending if path not in errors)
+        return errors
+
+    def run_job(self, job: Dict) -> Dict:
+        start = time.perf_counter()
+        if "error" in job:
+            return {"id": job["id"], "ok": False, "error": job["error"]}
+        try:
+            file_paths = job.get("uploaded_files", [])
+            questions = job.get("questions", [])
+            if isinstance(questions, str):
+                questions = questions.split("\n")
+            questions = [question for question in questions if question.strip()]
+
+            errors = self.sync(file_paths)
+            results = []
+            with self.lock.read():
+                for path in file_paths:
+                    if path not in self.qa_system.documents:
+                        errors.setdefault(path, "document is not in the index")
+                if errors:
+                    return {"id": job["id"], "ok": False, "error": f"Could not index {', '.join(errors)}",
+                            "failed_files": errors, "seconds": time.perf_counter() - start}
+                for batch in batched(questions, QUERY_BATCH_SIZE):
+                    results.extend(self.qa_system.query_batch(batch, job.get("top_k", self.top_k), sources=file_paths))
+        except Exception as e:
+            logger.exception(f"Batch job {job['id']} failed")
+            return {"id": job["id"], "ok": False, "error": str(e), "seconds": time.perf_counter() - start}
+        metrics.count("batch_jobs")
+        return {"id": job["id"], "ok": True, "results": results, "seconds": time.perf_counter() - start}
+
+    def save(self):
+        with self.lock.write(), metrics.stage("index_save"):
+            self.qa_system.save_index()
+
+    def run(self, jobs_path: str, output_path: str, concurrency: int = 1, resume: bool = False) -> Dict:
+        done = completed_job_ids(output_path) if resume else set()
+        if done:
+            logger.info(f"Resuming: {len(done)} jobs already completed in {output_path}")
+
+        stats = {"completed": 0, "failed": 0, "skipped": 0}
+        # Only a bounded window of jobs is in flight, so huge job files are never read into memory at once
+        window = max(concurrency, 1) * 2
+        with ResultWriter(output_path, append=resume) as writer, \
+                ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            running = set()
+
+            def collect(futures):
+                for future in futures:
+                    record = future.result()
+                    writer.write(record)
+                    stats["completed" if record["ok"] else "failed"] += 1
+                    finished = stats["completed"] + stats["failed"]
+                    if finished % SAVE_EVERY_JOBS == 0:
+                        self.save()
+                    logger.info(f"Batch job {record['id']} {'done' if record['ok'] else 'failed'} ({finished} finished)")
+
+            for job in read_jobs(jobs_path):
+                if job["id"] in done:
+                    stats["skipped"] += 1
+                    continue
+                running.add(executor.submit(self.run_job, job))
+                if len(running) >= window:
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            collect(wait(running).done)
+
+        self.save()
+        return stats
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from index_factory import create_index, set_search_params, training_sample, uses_inner_product
+
+CONFIGS = [
+    ("flat-ip", {}),
+    ("ivf-flat", {"nprobe": 1}),
+    ("ivf-flat", {"nprobe": 8}),
+    ("ivf-flat", {"nprobe": 32}),
+    ("ivf-flat-ip", {"nprobe": 8}),
+    ("ivf-pq", {"nprobe": 8}),
+    ("ivf-pq", {"nprobe": 32}),
+    ("hnsw", {"ef_search": 16}),
+    ("hnsw", {"ef_search": 64}),
+    ("hnsw", {"ef_search": 256}),
+    ("hnsw-ip", {"ef_search": 64}),
+]
+
+
+def clustered_vectors(count: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    # Sentence embeddings are far from uniform; clustered Gaussians are a closer stand-in
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    return centers[labels] + 0.3 * rng.normal(size=(count, dimension)).astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def evaluate(index_type, search_params, vectors, queries, ground_truth, k, build_params):
+    prepare = normalize if uses_inner_product(index_type) else (lambda x: x)
+    data, query_data = prepare(vectors), prepare(queries)
+
+    start = time.perf_counter()
+    index = create_index(index_type, vectors.shape[1], **build_params)
+    if not index.is_trained:
+        index.train(training_sample(data, max(65536, 39 * build_params["nlist"])))
+    index.add(data)
+    build_seconds = time.perf_counter() - start
+
+    set_search_params(index, **search_params)
+    start = time.perf_counter()
+    _, labels = index.search(query_data, k)
+    search_seconds = time.perf_counter() - start
+
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(labels, ground_truth))
+    return {
+        "index_type": index_type,
+        **search_params,
+        "recall_at_k": hits / ground_truth.size,
+        "ms_per_query": 1000 * search_seconds / len(queries),
+        "build_seconds": build_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of the ANN index types against exact search")
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--embeddings", help="optional .npy file of real chunk embeddings to use instead")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--json", help="write the results to this file as well")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), size=args.queries)] + 0.05 * rng.normal(size=(args.queries, vectors.shape[1]))
+        queries = queries.astype(np.float32)
+    else:
+        vectors = clustered_vectors(args.vectors, args.dimension, clusters=200, seed=0)
+        queries = clustered_vectors(args.queries, args.dimension, clusters=200, seed=1)
+
+    build_params = {"nlist": args.nlist, "pq_m": args.pq_m, "hnsw_m": args.hnsw_m}
+    baseline = create_index("flat", vectors.shape[1])
+    baseline.add(vectors)
+    start = time.perf_counter()
+    _, ground_truth = baseline.search(queries, args.k)
+    flat_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    # Inner-product variants rank by cosine, so their ground truth is exact cosine search
+    cosine_baseline = create_index("flat-ip", vectors.shape[1])
+    cosine_baseline.add(normalize(vectors))
+    _, cosine_ground_truth = cosine_baseline.search(normalize(queries), args.k)
+
+    results = [{"index_type": "flat", "recall_at_k": 1.0, "ms_per_query": flat_ms, "build_seconds": 0.0}]
+    for index_type, search_params in CONFIGS:
+        truth = cosine_ground_truth if uses_inner_product(index_type) else ground_truth
+        results.append(evaluate(index_type, search_params, vectors, queries, truth, args.k, build_params))
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{args.k}")
+    print(f"{'index':<14} {'param':<14} {'recall':>8} {'ms/query':>10} {'speedup':>8} {'build s':>8}")
+    for result in results:
+        param = ", ".join(f"{key}={result[key]}" for key in ("nprobe", "ef_search") if key in result) or "-"
+        print(f"{result['index_type']:<14} {param:<14} {result['recall_at_k']:>8.3f} {result['ms_per_query']:>10.4f} "
+              f"{flat_ms / result['ms_per_query']:>8.1f} {result['build_seconds']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"k": args.k, "vectors": len(vectors), "queries": len(queries), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from extract import AdvancedDocumentQA
+
+WORDS = (
+    "frontend developer experience freelancer education faculty economics engineering "
+    "management software technical school projects weather app javascript social media "
+    "react typescript skills languages python data analysis machine learning research "
+    "team lead product design backend api database cloud deployment testing"
+).split()
+
+
+def synthetic_chunks(count: int, chunk_size: int = 400, seed: int = 0):
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        words = []
+        while len(" ".join(words)) < chunk_size:
+            words.append(rng.choice(WORDS))
+        chunks.append(" ".join(words)[:chunk_size])
+    return chunks
+
+
+def run(qa_system, chunks, batch_size):
+    start = time.perf_counter()
+    if batch_size == 1:
+        embeddings = np.vstack([qa_system.embed_texts([chunk], batch_size=1) for chunk in chunks])
+    else:
+        embeddings = qa_system.embed_texts(chunks, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return embeddings, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-chunk and batched embedding throughput")
+    parser.add_argument("--chunks", type=int, default=256)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32, 64])
+    args = parser.parse_args()
+
+    qa_system = AdvancedDocumentQA("embedding-benchmark", embedding_cache=None)
+    chunks = synthetic_chunks(args.chunks)
+
+    # Warm up so the first measured run does not pay for lazy initialisation
+    qa_system.embed_texts(chunks[:4])
+
+    baseline, baseline_time = run(qa_system, chunks, 1)
+    print(f"{'batch_size':>10} {'seconds':>10} {'chunks/sec':>12} {'speedup':>8} {'max_abs_diff':>13}")
+    print(f"{1:>10} {baseline_time:>10.3f} {len(chunks) / baseline_time:>12.1f} {1.0:>8.2f} {0.0:>13.2e}")
+
+    for batch_size in args.batch_sizes:
+        embeddings, elapsed = run(qa_system, chunks, batch_size)
+        diff = float(np.abs(embeddings - baseline).max())
+        print(f"{batch_size:>10} {elapsed:>10.3f} {len(chunks) / elapsed:>12.1f} "
+              f"{baseline_time / elapsed:>8.2f} {diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost of the RiterAI modules")
+    parser.add_argument("modules", nargs="*", default=["extract", "generate", "worker", "chunk_store"])
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="exit non-zero if any module takes longer than this to import")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        entries = measure(module)
+        total = next((cumulative for name, _, cumulative in entries if name.strip() == module), 0) / 1000
+        print(f"{module}: {total:.1f} ms")
+        for name, self_us, cumulative_us in sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]:
+            print(f"    {self_us / 1000:>8.1f} ms self {cumulative_us / 1000:>9.1f} ms cumulative  {name.strip()}")
+
+        if args.max_ms is not None and total > args.max_ms:
+            print(f"{module} import took {total:.1f} ms, over the {args.max_ms:.1f} ms budget")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
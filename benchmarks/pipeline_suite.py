@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# The suite must run on machines without network access, using only locally cached models
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SIZES = {
+    "small": {"documents": 4, "pages": 2},
+    "medium": {"documents": 16, "pages": 8},
+    "large": {"documents": 64, "pages": 16},
+}
+WORDS = (
+    "developer experience freelancer education faculty economics engineering management software "
+    "technical school project weather application javascript social media react typescript skill "
+    "language python data analysis machine learning research team lead product design backend "
+    "database cloud deployment testing customer report revenue growth strategy market"
+).split()
+QUESTIONS = [
+    "What are your projects?",
+    "Which programming languages do you know?",
+    "Describe your education.",
+    "What is your experience with cloud deployment?",
+    "Have you led a team?",
+]
+
+
+def paragraph(rng: random.Random, sentences: int = 6) -> str:
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def page_text(rng: random.Random) -> str:
+    return "\n\n".join(paragraph(rng) for _ in range(5))
+
+
+def generate_corpus(directory: str, documents: int, pages: int, seed: int = 0):
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    paths = []
+    for i in range(documents):
+        if i % 2 == 0:
+            path = os.path.join(directory, f"doc_{i:03d}.pdf")
+            with fitz.open() as pdf:
+                for _ in range(pages):
+                    pdf.new_page().insert_textbox(fitz.Rect(40, 40, 560, 800), page_text(rng), fontsize=8)
+                pdf.save(path)
+        else:
+            path = os.path.join(directory, f"doc_{i:03d}.txt")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("\n\n".join(page_text(rng) for _ in range(pages)))
+        paths.append(path)
+    return paths
+
+
+def memory_mb():
+    # VmHWM is the peak RSS; writing 5 to clear_refs resets it so each stage gets its own peak (Linux only)
+    status = {}
+    try:
+        with open("/proc/self/status", encoding="utf-8") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                status[key] = value.strip()
+        return int(status["VmRSS"].split()[0]) / 1024, int(status["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+        return peak, peak
+
+
+def reset_peak_memory():
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+class Stage:
+    def __init__(self, results: dict, name: str):
+        self.results = results
+        self.name = name
+
+    def __enter__(self):
+        reset_peak_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        rss, peak = memory_mb()
+        self.results.setdefault(self.name, {}).update({"seconds": seconds, "rss_mb": rss, "peak_rss_mb": peak})
+
+
+def percentiles(samples):
+    import numpy as np
+
+    values = np.array(samples) * 1000
+    return {f"p{p}_ms": float(np.percentile(values, p)) for p in (50, 90, 95, 99)}
+
+
+def run_size(name: str, repeats: int) -> dict:
+    import faiss
+
+    import extract
+    from extract import AdvancedDocumentQA, iter_chunks
+
+    spec = SIZES[name]
+    stages = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(corpus_dir)
+        paths = generate_corpus(corpus_dir, spec["documents"], spec["pages"])
+        corpus_bytes = sum(os.path.getsize(path) for path in paths)
+
+        extract.INDEX_ROOT = os.path.join(workdir, "indexes")
+        qa_system = AdvancedDocumentQA("benchmark", embedding_cache=None, query_cache_size=0)
+        qa_system.embed_texts(["warm up the model"])
+        extract.get_nlp()
+
+        with Stage(stages, "extract"):
+            pages = [page for path in paths for page in extract.iter_document_pages(path)]
+        stages["extract"]["pages"] = len(pages)
+
+        with Stage(stages, "preprocess"):
+            cleaned = list(qa_system.preprocess_stream(pages))
+
+        with Stage(stages, "chunk"):
+            chunks = list(iter_chunks(cleaned))
+        stages["chunk"]["chunks"] = len(chunks)
+
+        with Stage(stages, "embed"):
+            embeddings = qa_system.embed_texts(chunks)
+        stages["embed"]["chunks_per_sec"] = len(chunks) / stages["embed"]["seconds"]
+
+        with Stage(stages, "index_add"):
+            index = faiss.IndexFlatL2(embeddings.shape[1])
+            index.add(embeddings)
+        stages["index_add"]["index_bytes"] = int(faiss.serialize_index(index).nbytes)
+
+        # End to end: the streaming ingest path exactly as run_job uses it
+        qa_system = AdvancedDocumentQA("benchmark", embedding_cache=None, query_cache_size=0)
+        with Stage(stages, "ingest"):
+            qa_system.sync_documents(paths)
+        stages["ingest"]["chunks"] = len(qa_system.chunks)
+        stages["ingest"]["chunks_per_sec"] = len(qa_system.chunks) / stages["ingest"]["seconds"]
+        index_dir = qa_system.index_dir
+        stages["ingest"]["index_dir_bytes"] = sum(
+            os.path.getsize(os.path.join(index_dir, file)) for file in os.listdir(index_dir))
+
+        latencies = []
+        with Stage(stages, "query"):
+            for _ in range(repeats):
+                for question in QUESTIONS:
+                    start = time.perf_counter()
+                    qa_system.query_and_extract_info(question)
+                    latencies.append(time.perf_counter() - start)
+        stages["query"].update(percentiles(latencies))
+        stages["query"]["queries"] = len(latencies)
+
+        with Stage(stages, "query_batch"):
+            for _ in range(repeats):
+                qa_system.query_batch(QUESTIONS)
+        stages["query_batch"]["ms_per_query"] = 1000 * stages["query_batch"]["seconds"] / (repeats * len(QUESTIONS))
+
+    return {"size": name, **spec, "corpus_bytes": corpus_bytes, "stages": stages}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def print_summary(report: dict, baseline: dict = None):
+    previous = {run["size"]: run for run in baseline["runs"]} if baseline else {}
+    print(f"commit {report['environment']['commit']}")
+    for run in report["runs"]:
+        print(f"\n{run['size']}: {run['documents']} documents x {run['pages']} pages, {run['corpus_bytes']} bytes")
+        for stage, values in run["stages"].items():
+            line = f"  {stage:<12} {values['seconds']:>8.3f}s  peak {values['peak_rss_mb']:>8.1f} MB"
+            before = previous.get(run["size"], {}).get("stages", {}).get(stage)
+            if before:
+                line += f"  ({(values['seconds'] / before['seconds'] - 1) * 100:+.1f}% time)"
+            extras = {key: value for key, value in values.items() if key not in ("seconds", "rss_mb", "peak_rss_mb")}
+            if extras:
+                line += "  " + ", ".join(f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+                                         for key, value in extras.items())
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for the AdvancedDocumentQA pipeline")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"])
+    parser.add_argument("--repeats", type=int, default=5, help="times each query is repeated")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to compare stage timings against")
+    parser.add_argument("--single", choices=list(SIZES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_size(args.single, args.repeats)))
+        return
+
+    # Each size runs in a fresh interpreter so peak RSS and warm caches do not leak between sizes
+    runs = []
+    for size in args.sizes:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single", size, "--repeats", str(args.repeats)],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            sys.exit(f"Benchmark for size {size} failed")
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {"environment": environment(), "runs": runs}
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_summary(report, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from embedding_throughput import synthetic_chunks
+from extract import AdvancedDocumentQA
+
+QUERIES = [
+    "What are your projects?",
+    "Which programming languages do you know?",
+    "Describe your education.",
+    "What frontend frameworks have you used?",
+    "Tell me about your work experience.",
+    "Have you worked with machine learning?",
+    "What cloud and deployment experience do you have?",
+    "Which databases have you used?",
+]
+
+
+def embed(qa_system, texts, repeats):
+    qa_system.embed_texts(texts[:8])  # warm up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = qa_system.embed_texts(texts)
+        best = min(best, time.perf_counter() - start)
+    return embeddings, best
+
+
+def rankings(chunk_vectors, query_vectors, k):
+    chunk_vectors = chunk_vectors.astype(np.float32)
+    chunk_vectors /= np.linalg.norm(chunk_vectors, axis=1, keepdims=True)
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return np.argsort(-(query_vectors @ chunk_vectors.T), axis=1, kind="stable")[:, :k]
+
+
+def compare(baseline, candidate):
+    overlap = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(baseline, candidate)])
+    top1 = np.mean(baseline[:, 0] == candidate[:, 0])
+    return float(overlap), float(top1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and ranking drift of int8 / float16 embedding modes")
+    parser.add_argument("--chunks", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", help="write the results to this file as well")
+    args = parser.parse_args()
+
+    corpus = synthetic_chunks(args.chunks, seed=42)
+    modes = {
+        "fp32": AdvancedDocumentQA("quantization-benchmark", embedding_cache=None, num_threads=args.threads),
+        "int8": AdvancedDocumentQA("quantization-benchmark", embedding_cache=None, num_threads=args.threads,
+                                   fast_embedding=True),
+    }
+
+    embeddings = {}
+    results = []
+    for name, qa_system in modes.items():
+        vectors, seconds = embed(qa_system, corpus, args.repeats)
+        embeddings[name] = (vectors, qa_system.embed_texts(QUERIES))
+        results.append({"mode": name, "chunks_per_sec": len(corpus) / seconds, "seconds": seconds})
+
+    # float16 storage only changes how chunk vectors are kept; queries stay fp32
+    fp32_vectors, fp32_queries = embeddings["fp32"]
+    int8_vectors, int8_queries = embeddings["int8"]
+    baseline = rankings(fp32_vectors, fp32_queries, args.k)
+    variants = {
+        "int8": rankings(int8_vectors, int8_queries, args.k),
+        "fp32+fp16 storage": rankings(fp32_vectors.astype(np.float16), fp32_queries, args.k),
+        "int8+fp16 storage": rankings(int8_vectors.astype(np.float16), int8_queries, args.k),
+    }
+
+    fp32_speed = results[0]["chunks_per_sec"]
+    print(f"{len(corpus)} chunks, {len(QUERIES)} queries, threads={args.threads or 'default'}")
+    print(f"{'mode':<20} {'chunks/sec':>11} {'speedup':>8}")
+    for result in results:
+        print(f"{result['mode']:<20} {result['chunks_per_sec']:>11.1f} {result['chunks_per_sec'] / fp32_speed:>8.2f}")
+
+    cosine = np.sum(fp32_vectors * int8_vectors, axis=1) / (
+        np.linalg.norm(fp32_vectors, axis=1) * np.linalg.norm(int8_vectors, axis=1))
+    print(f"\nmean cosine(fp32, int8) per chunk: {cosine.mean():.4f} (min {cosine.min():.4f})")
+    print(f"{'ranking vs fp32':<20} {f'overlap@{args.k}':>11} {'top-1 agree':>12}")
+    drift = {}
+    for name, ranking in variants.items():
+        overlap, top1 = compare(baseline, ranking)
+        drift[name] = {"overlap_at_k": overlap, "top1_agreement": top1}
+        print(f"{name:<20} {overlap:>11.3f} {top1:>12.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"k": args.k, "chunks": len(corpus), "throughput": results, "ranking_drift": drift,
+                       "mean_cosine_fp32_int8": float(cosine.mean())}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import json
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+STORE_FILES = ["chunk_sources.json", "chunk_source_ids.npy", "chunk_offsets.npy", "chunk_text.bin", "chunk_vectors.npy"]
+
+
+def pack_texts(texts: List[str]) -> Tuple[np.ndarray, bytes]:
+    encoded = [text.encode('utf-8') for text in texts]
+    lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+    return lengths, b"".join(encoded)
+
+
+def append_rows(buffer: np.ndarray, used: int, rows: np.ndarray) -> np.ndarray:
+    # Writes rows after the first `used` rows of buffer. A full (or read-only, memory-mapped) buffer is
+    # reallocated with doubled capacity, so a long run of small appends stays amortised O(1) per row.
+    needed = used + len(rows)
+    if len(buffer) < needed or not buffer.flags.writeable:
+        grown = np.empty((max(needed, 2 * len(buffer)), *buffer.shape[1:]), dtype=buffer.dtype)
+        grown[:used] = buffer[:used]
+        buffer = grown
+    buffer[used:needed] = rows
+    return buffer
+
+
+def in_memory(array):
+    # Copies a memory-mapped array into memory; anything else is returned as it is
+    return np.array(array) if isinstance(array, np.memmap) else array
+
+
+def compact_texts(buffer, offsets: np.ndarray, keep: np.ndarray) -> Tuple[bytearray, np.ndarray]:
+    starts, ends = offsets[:-1][keep], offsets[1:][keep]
+    compacted = bytearray(b"".join(bytes(buffer[start:end]) for start, end in zip(starts, ends)))
+    return compacted, np.concatenate([[0], np.cumsum(ends - starts)]).astype(np.int64)
+
+
+class ChunkStore:
+    # Chunk i lives at FAISS position i: its text is text_buffer[offsets[i]:offsets[i + 1]],
+    # its source path is sources[source_ids[i]] and its embedding is vectors[i].
+    def __init__(self, vector_dtype="float32"):
+        self.sources: List[str] = []
+        self.source_lookup = {}
+        self.size = 0
+        self.source_ids = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.text_buffer = bytearray()
+        self.vectors = None
+        self.vector_dtype = np.dtype(vector_dtype)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # The arrays below are over-allocated by add(); these views cover only the stored chunks
+    @property
+    def source_ids(self) -> np.ndarray:
+        return self._source_ids[:self.size]
+
+    @source_ids.setter
+    def source_ids(self, source_ids: np.ndarray):
+        self._source_ids = source_ids
+        self.size = len(source_ids)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self.size + 1]
+
+    @offsets.setter
+    def offsets(self, offsets: np.ndarray):
+        self._offsets = offsets
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return None if self._vectors is None else self._vectors[:self.size]
+
+    @vectors.setter
+    def vectors(self, vectors: np.ndarray):
+        self._vectors = vectors
+
+    def source_id(self, source: str) -> int:
+        if source not in self.source_lookup:
+            self.source_lookup[source] = len(self.sources)
+            self.sources.append(source)
+        return self.source_lookup[source]
+
+    def add(self, source: str, texts: List[str], vectors: np.ndarray):
+        if not texts:
+            return
+        lengths, encoded = pack_texts(texts)
+
+        self._make_writable()
+        source_id = self.source_id(source)
+        self._offsets = append_rows(self._offsets, self.size + 1, self._offsets[self.size] + np.cumsum(lengths))
+        self._source_ids = append_rows(self._source_ids, self.size, np.full(len(texts), source_id, dtype=np.int32))
+        self.text_buffer.extend(encoded)
+
+        vectors = np.asarray(vectors, dtype=self.vector_dtype)
+        if self._vectors is None:
+            self._vectors = np.empty((0, vectors.shape[1]), dtype=self.vector_dtype)
+        self._vectors = append_rows(self._vectors, self.size, vectors)
+        self.size += len(texts)
+
+    def text(self, idx: int) -> str:
+        return bytes(self.text_buffer[self.offsets[idx]:self.offsets[idx + 1]]).decode('utf-8')
+
+    def convert_vectors(self, vector_dtype):
+        self.vector_dtype = np.dtype(vector_dtype)
+        if self.vectors is not None:
+            self.vectors = np.asarray(self.vectors).astype(self.vector_dtype)
+
+    def source(self, idx: int) -> str:
+        return self.sources[self.source_ids[idx]]
+
+    def get(self, idx: int) -> Tuple[str, str]:
+        return self.text(idx), self.source(idx)
+
+    def count(self, source: str) -> int:
+        if source not in self.source_lookup:
+            return 0
+        return int(np.count_nonzero(self.source_ids == self.source_lookup[source]))
+
+    def ids_for(self, sources: List[str]) -> np.ndarray:
+        source_ids = [self.source_lookup[source] for source in sources if source in self.source_lookup]
+        return np.flatnonzero(np.isin(self.source_ids, source_ids))
+
+    def remove_sources(self, sources: List[str]) -> np.ndarray:
+        removed_ids = [self.source_lookup[source] for source in sources if source in self.source_lookup]
+        keep = ~np.isin(self.source_ids, removed_ids)
+        if keep.all():
+            return keep
+
+        # Re-number the surviving sources so the lookup table does not grow with every removal
+        survivors = [source for source in self.sources if source not in sources]
+        remap = np.full(len(self.sources), -1, dtype=np.int32)
+        for new_id, source in enumerate(survivors):
+            remap[self.source_lookup[source]] = new_id
+
+        # source_ids goes last: setting it changes the length of the offsets and vectors views
+        self.text_buffer, self.offsets = compact_texts(self.text_buffer, self.offsets, keep)
+        self.vectors = self.vectors[keep]
+        self.source_ids = remap[self.source_ids[keep]]
+        self.sources = survivors
+        self.source_lookup = {source: i for i, source in enumerate(survivors)}
+        return keep
+
+    def save(self, directory: str):
+        # Windows refuses to replace a file that is still mapped, so a loaded store lets go of its maps first
+        self._make_writable()
+        self._source_ids, self._offsets, self._vectors = map(in_memory, (self._source_ids, self._offsets, self._vectors))
+        os.makedirs(directory, exist_ok=True)
+        path = lambda name: os.path.join(directory, name)
+
+        with open(path("chunk_sources.json.tmp"), 'w', encoding='utf-8') as file:
+            json.dump(self.sources, file)
+        with open(path("chunk_source_ids.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.source_ids))
+        with open(path("chunk_offsets.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.offsets))
+        with open(path("chunk_text.bin.tmp"), 'wb') as file:
+            file.write(self.text_buffer)
+        with open(path("chunk_vectors.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=self.vector_dtype)))
+
+        for name in STORE_FILES:
+            os.replace(path(name + ".tmp"), path(name))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ChunkStore":
+        store = cls()
+        with open(os.path.join(directory, "chunk_sources.json"), 'r', encoding='utf-8') as file:
+            store.sources = json.load(file)
+        store.source_lookup = {source: i for i, source in enumerate(store.sources)}
+
+        mmap_mode = 'r' if mmap else None
+        store.source_ids = np.load(os.path.join(directory, "chunk_source_ids.npy"), mmap_mode=mmap_mode)
+        store.offsets = np.load(os.path.join(directory, "chunk_offsets.npy"), mmap_mode=mmap_mode)
+        store.text_buffer = cls._load_buffer(os.path.join(directory, "chunk_text.bin"), mmap)
+
+        vectors = np.load(os.path.join(directory, "chunk_vectors.npy"), mmap_mode=mmap_mode)
+        store.vectors = vectors if len(vectors) else None
+        store.vector_dtype = vectors.dtype
+
+        count = len(store.source_ids)
+        if len(store._offsets) != count + 1 or len(vectors) != count:
+            raise ValueError(f"Chunk store in {directory} is inconsistent")
+        return store
+
+    @staticmethod
+    def _load_buffer(path: str, mmap: bool):
+        if mmap and os.path.getsize(path):
+            return np.memmap(path, dtype=np.uint8, mode='r')
+        with open(path, 'rb') as file:
+            return bytearray(file.read())
+
+    def _make_writable(self):
+        # Memory-mapped stores are read-only; copy into memory the first time they change
+        if not isinstance(self.text_buffer, bytearray):
+            self.text_buffer = bytearray(self.text_buffer.tobytes())
@@ -0,0 +1,165 @@
+import json
+import os
+import zlib
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from chunk_store import append_rows
+
+DEDUP_FILES = ["dedup_signatures.npy", "dedup_aliases.json"]
+# Smallest prime above 2**32, so every 32-bit shingle hash is a distinct residue
+HASH_PRIME = np.uint64(4294967311)
+
+
+def shingles(text: str, size: int = 3) -> List[bytes]:
+    words = text.split()
+    if len(words) <= size:
+        return [" ".join(words).encode('utf-8')]
+    return [" ".join(words[i:i + size]).encode('utf-8') for i in range(len(words) - size + 1)]
+
+
+def band_rows(threshold: float, num_perm: int) -> int:
+    # Widest band whose LSH collision curve still catches pairs comfortably below the threshold;
+    # candidates are then verified against the threshold on the full signature.
+    for rows in range(num_perm, 0, -1):
+        if num_perm % rows == 0 and (rows / num_perm) ** (1 / rows) <= threshold * 0.85:
+            return rows
+    return 1
+
+
+class DuplicateIndex:
+    # MinHash signatures of the stored chunks, row i for chunk i like the chunk store, bucketed with LSH.
+    # A chunk whose estimated Jaccard similarity to a stored one reaches the threshold is not stored again;
+    # the document it came from is recorded as an alias of the stored chunk instead.
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Multipliers stay below 2**31 so (a * hash + b) never overflows uint64
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.rows = band_rows(threshold, num_perm) if threshold else num_perm
+        self.size = 0
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.aliases: List[Tuple[int, str]] = []
+        self.buckets = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    # Over-allocated by add(); the view covers only the stored chunks
+    @property
+    def signatures(self) -> np.ndarray:
+        return self._signatures[:self.size]
+
+    @signatures.setter
+    def signatures(self, signatures: np.ndarray):
+        self._signatures = signatures
+        self.size = len(signatures)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.threshold)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(shingle) for shingle in shingles(text, self.shingle_size)), dtype=np.uint64)
+        permuted = (hashes[:, None] * self.a + self.b) % HASH_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(start, signature[start:start + self.rows].tobytes()) for start in range(0, self.num_perm, self.rows)]
+
+    def similarity(self, signature: np.ndarray, idx: int, pending: List[np.ndarray]) -> float:
+        other = self.signatures[idx] if idx < len(self) else pending[idx - len(self)]
+        return float(np.mean(signature == other))
+
+    def select(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns the signatures and, per text, the id of the chunk it duplicates or -1 when it is new.
+        # Texts kept from earlier in the batch count as stored, at the ids they will be added under.
+        signatures = np.vstack([self.signature(text) for text in texts]) if texts else self.signatures[:0]
+        duplicate_of = np.full(len(texts), -1, dtype=np.int64)
+        if not self.enabled:
+            return signatures, duplicate_of
+
+        pending, pending_buckets = [], {}
+        for i, signature in enumerate(signatures):
+            keys = self.band_keys(signature)
+            candidates = dict.fromkeys(idx for key in keys
+                                       for idx in self.buckets.get(key, []) + pending_buckets.get(key, []))
+            for idx in candidates:
+                if self.similarity(signature, idx, pending) >= self.threshold:
+                    duplicate_of[i] = idx
+                    break
+            else:
+                for key in keys:
+                    pending_buckets.setdefault(key, []).append(len(self) + len(pending))
+                pending.append(signature)
+        return signatures, duplicate_of
+
+    def add(self, signatures: np.ndarray):
+        start = len(self)
+        self._signatures = append_rows(self._signatures, start, np.asarray(signatures, dtype=np.uint32))
+        self.size += len(signatures)
+        for offset, signature in enumerate(signatures):
+            for key in self.band_keys(signature):
+                self.buckets.setdefault(key, []).append(start + offset)
+
+    def add_aliases(self, source: str, chunk_ids: np.ndarray):
+        self.aliases.extend((int(idx), source) for idx in chunk_ids)
+
+    def aliases_for(self, sources) -> Dict[int, str]:
+        # Stored chunk id -> one of the given sources that aliases it
+        return {idx: source for idx, source in self.aliases if source in sources}
+
+    def remove(self, keep: np.ndarray, sources: Set[str]) -> Set[str]:
+        # Drops the removed chunks and the removed documents' aliases. Returns the other documents that
+        # aliased a removed chunk: that text is no longer stored anywhere, so they need re-ingesting.
+        new_ids = np.cumsum(keep) - 1
+        affected, aliases = set(), []
+        for idx, source in self.aliases:
+            if source in sources:
+                continue
+            if not keep[idx]:
+                affected.add(source)
+                continue
+            aliases.append((int(new_ids[idx]), source))
+        self.aliases = aliases
+
+        if not keep.all():
+            self.signatures = self.signatures[keep]
+            self.rebuild_buckets()
+        return affected
+
+    def rebuild_buckets(self):
+        self.buckets = {}
+        for idx, signature in enumerate(self.signatures):
+            for key in self.band_keys(signature):
+                self.buckets.setdefault(key, []).append(idx)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        path = lambda name: os.path.join(directory, name)
+
+        with open(path("dedup_signatures.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.signatures))
+        with open(path("dedup_aliases.json.tmp"), 'w', encoding='utf-8') as file:
+            json.dump({"num_perm": self.num_perm, "shingle_size": self.shingle_size, "seed": self.seed,
+                       "aliases": self.aliases}, file)
+
+        for name in DEDUP_FILES:
+            os.replace(path(name + ".tmp"), path(name))
+
+    @classmethod
+    def load(cls, directory: str, threshold: float = 0.9) -> "DuplicateIndex":
+        with open(os.path.join(directory, "dedup_aliases.json"), 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        index = cls(threshold, num_perm=state["num_perm"], shingle_size=state["shingle_size"], seed=state["seed"])
+        index.signatures = np.load(os.path.join(directory, "dedup_signatures.npy"))
+        if index._signatures.shape[1:] != (index.num_perm,):
+            raise ValueError(f"Duplicate signatures in {directory} do not match num_perm={index.num_perm}")
+        index.aliases = [(int(idx), source) for idx, source in state["aliases"]]
+        index.rebuild_buckets()
+        return index
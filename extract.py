@@ -1,71 +1,542 @@
 import sys
+import argparse
 import json
 import ast
-import subprocess
 import os
-import nltk
-nltk.download('stopwords')
-nltk.download('punkt_tab')
 
 # There were some issues with different OpenMP, so the following two lines bypass them.
 # os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"    
 # os.environ["OMP_NUM_THREADS"] = "1"
  
-import fitz  # PyMuPDF
-import spacy
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
 import logging
 import re
+import hashlib
+import queue
+import threading
+import uuid
 import numpy as np
-import faiss  # Local vector database
 
-try:
-    from rake_nltk import Rake
-except ModuleNotFoundError:
-    print("rake_nltk module not found. Installing...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "rake_nltk"])
-    from rake_nltk import Rake
+from generate import REPORT_JSON_PATH, REPORT_JSONL_PATH, REPORT_TEXT_PATH, ReportWriter
+from chunk_store import ChunkStore
+from sparse_index import SparseIndex
+from dedup import DuplicateIndex
+from query_cache import QueryCache
+from embedding_cache import EmbeddingCache
+from metrics import metrics
+from index_factory import (INDEX_TYPES, create_index, exact_search, filtered_search_params, minimum_training_size,
+                           recommended_training_size, set_search_params, training_sample, uses_inner_product)
+import worker
+
+# torch, transformers, spaCy, faiss, scipy and PyMuPDF are imported on first use so that
+# importing this module (from the GUI, the worker or a benchmark) stays cheap.
+
+MODEL_NAME = "sentence-transformers/paraphrase-MiniLM-L6-v2"
+INDEX_ROOT = "indexes"
+EMBEDDING_CACHE_PATH = os.path.join("cache", "embeddings.sqlite")
+QUERY_CACHE_PATH = os.path.join("cache", "queries.sqlite")
+BATCH_OUTPUT_PATH = "batch_results.jsonl"
+# Command line options the resident worker cannot honour; setting any of them runs the job in-process
+LOCAL_OPTIONS = ["index_type", "nlist", "nprobe", "ef_search", "fast_embedding", "threads", "float16_vectors",
+                 "dedup_threshold", "query_cache"]
+INDEX_NAME = 'advanced-document-qa'
+# Only lemmas and stop-word flags are used, so the dependency parser and NER never need to run
+SPACY_DISABLED = ["parser", "ner"]
+SEGMENT_CHARS = 20000
+MAX_TRAINING_SAMPLE = 65536
+QUERY_BATCH_SIZE = 16
+# Searches restricted to at most this many chunks skip the ANN index and compare against every candidate
+EXACT_SEARCH_LIMIT = 20000
+
+_nlp = None
+
+
+def get_nlp():
+    global _nlp
+    if _nlp is None:
+        import spacy
+        _nlp = spacy.load('en_core_web_md', disable=SPACY_DISABLED)
+    return _nlp
+
+
+def split_segments(text: str, max_chars: int = SEGMENT_CHARS) -> Iterator[str]:
+    # Pack paragraphs into segments of at most max_chars, cutting oversized paragraphs at whitespace
+    segment = []
+    size = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield paragraph[:cut]
+            paragraph = paragraph[cut:]
+        if size + len(paragraph) > max_chars and segment:
+            yield "\n\n".join(segment)
+            segment, size = [], 0
+        segment.append(paragraph)
+        size += len(paragraph) + 2
+    if segment:
+        yield "\n\n".join(segment)
+
+
+def read_paragraphs(file, max_chars: int = SEGMENT_CHARS) -> Iterator[str]:
+    # Read a text file in bounded blocks, ending each block at a paragraph break or whitespace
+    carry = ""
+    while True:
+        data = file.read(max_chars)
+        if not data:
+            break
+        data = carry + data
+        cut = data.rfind("\n\n")
+        if cut <= 0:
+            cut = max(data.rfind(" "), data.rfind("\n"))
+        if cut <= 0:
+            cut = len(data)
+        yield data[:cut]
+        carry = data[cut:]
+    if carry:
+        yield carry
+
+
+def iter_chunks(texts: Iterable[str], chunk_size: int = 400, overlap: int = 50) -> Iterator[str]:
+    # Same windows as chunk_text over " ".join(texts), but only the unconsumed tail is kept in memory
+    step = chunk_size - overlap
+    buffer = ""
+    first = True
+    for text in texts:
+        buffer = text if first else f"{buffer} {text}"
+        first = False
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+    while buffer:
+        yield buffer[:chunk_size]
+        buffer = buffer[step:]
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Finished:
+    def __init__(self, error=None):
+        self.error = error
+
+
+def prefetch(items: Iterable, maxsize: int) -> Iterator:
+    # Run the producer in a background thread so parsing overlaps with the consumer's work;
+    # the bounded queue keeps at most maxsize items in flight.
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Finished(e))
+            return
+        put(_Finished())
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, _Finished):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def clean_doc(doc) -> str:
+    return " ".join([token.lemma_.lower() for token in doc if not token.is_stop and token.is_alpha])
+
+
+def preprocess_texts(texts: Iterable[str], batch_size: int = 16, n_process: int = 1) -> Iterator[str]:
+    segments = (segment for text in texts for segment in split_segments(text))
+    for doc in get_nlp().pipe(segments, batch_size=batch_size, n_process=n_process):
+        clean_text = clean_doc(doc)
+        if clean_text:
+            yield clean_text
+
+
+def lemmatize_queries(queries: List[str], batch_size: int = 16) -> List[str]:
+    # Unlike preprocess_texts this keeps one entry per query, empty when only stop words or
+    # non-alphabetic tokens remain, so the result stays aligned with the questions
+    return [clean_doc(doc) for doc in get_nlp().pipe(queries, batch_size=batch_size)]
 
-from transformers import AutoTokenizer, AutoModel
-from sklearn.model_selection import train_test_split
-import torch
 
-from generate import Generate_Main
+def iter_document_pages(file_path: str) -> Iterator[str]:
+    if file_path.lower().endswith('.pdf'):
+        import fitz  # PyMuPDF
+
+        with fitz.open(file_path) as pdf:
+            for page in pdf:
+                yield page.get_text()
+    elif file_path.lower().endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as file:
+            yield from read_paragraphs(file)
+    else:
+        logging.getLogger(__name__).warning(f"Unsupported file type: {file_path}")
+
+
+def extract_document(file_path: str, nlp_batch_size: int = 16) -> List[str]:
+    # Runs inside ingest worker processes, so it must stay a picklable module-level function
+    pages = metrics.timed_iter("extract", iter_document_pages(file_path))
+    return list(metrics.timed_iter("preprocess", preprocess_texts(pages, batch_size=nlp_batch_size)))
+
+
+class JobCancelled(Exception):
+    pass
 
-nlp = spacy.load('en_core_web_md')
 
 class AdvancedDocumentQA:
-    def __init__(self, index_name):
+    def __init__(self, index_name, batch_size: int = 32, nlp_batch_size: int = 16, nlp_n_process: int = 1,
+                 ingest_workers: int = 1, index_type: str = "flat", nlist: int = 256, pq_m: int = 16,
+                 hnsw_m: int = 32, nprobe: int = 16, ef_search: int = 64,
+                 embedding_cache: str = EMBEDDING_CACHE_PATH, embedding_cache_size: int = 200000,
+                 fast_embedding: bool = False, num_threads: int = None, vector_dtype: str = "float32",
+                 dedup_threshold: float = 0.9, query_cache_size: int = 1024, query_cache_path: str = None):
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
-        self.tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/paraphrase-MiniLM-L6-v2")
-        self.model = AutoModel.from_pretrained("sentence-transformers/paraphrase-MiniLM-L6-v2")
-
-        self.dimension = self.model.config.hidden_size
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.metadata = {}
+        self._tokenizer = None
+        self._model = None
+        # Fast tokenizers are not safe to call from several threads at once, and the model must load only once
+        self.model_lock = threading.RLock()
+        self.index = None
+        self.chunks = ChunkStore(vector_dtype)
+        self.sparse = SparseIndex()
+        # Near-duplicate chunks at or above this estimated Jaccard similarity are stored once; 0 disables it
+        self.dedup_threshold = dedup_threshold
+        self.duplicates = DuplicateIndex(dedup_threshold)
+        # Documents that lost aliased chunks when the document they duplicated was removed
+        self.reingest = set()
+        self.documents = {}
         self.index_name = index_name
-        self.logger.info(f"FAISS index {index_name} initialized with dimension {self.dimension}")
+        self.index_dir = os.path.join(INDEX_ROOT, index_name)
+        self.batch_size = batch_size
+        self.nlp_batch_size = nlp_batch_size
+        self.nlp_n_process = nlp_n_process
+        self.ingest_workers = ingest_workers
+        self.index_config = {"index_type": index_type, "nlist": nlist, "pq_m": pq_m, "hnsw_m": hnsw_m}
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.fast_embedding = fast_embedding
+        self.num_threads = num_threads
+        self.vector_dtype = np.dtype(vector_dtype)
+        # int8 vectors differ slightly from fp32 ones, so they get their own cache entries and index
+        self.embedding_key = f"{MODEL_NAME}:int8" if fast_embedding else MODEL_NAME
+        self.embedding_cache = EmbeddingCache(embedding_cache, self.embedding_key, embedding_cache_size) if embedding_cache else None
+        self.query_cache = QueryCache(index_name, query_cache_size, query_cache_path) if query_cache_size else None
+        # Changes whenever the searchable content does, so cached query results of older versions are never served
+        self.index_version = uuid.uuid4().hex
+        self.dirty = False
+        # Optional callable receiving progress events; it may raise JobCancelled to stop the job
+        self.progress = None
+
+        if self.load_index():
+            self.logger.info(f"FAISS index {index_name} loaded with {self.index.ntotal} vectors")
+        else:
+            self.logger.info(f"FAISS index {index_name} initialized")
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._load_model()
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_model()
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        if self.index is not None:
+            return self.index.d
+        return self.model.config.hidden_size
+
+    def _load_model(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        with self.model_lock:
+            if self._model is not None:
+                return
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+            model = AutoModel.from_pretrained(MODEL_NAME)
+            model.eval()
+            if self.fast_embedding:
+                # Dynamic quantization stores Linear weights as int8 and quantizes activations on the fly
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._tokenizer, self._model = tokenizer, model
+        self.logger.info(f"Loaded embedding model {self.embedding_key} using {torch.get_num_threads()} threads")
+
+    def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.array(vectors, dtype=np.float32)
+        if uses_inner_product(self.index_config["index_type"]):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _add_vectors(self, embeddings: np.ndarray):
+        if self.index is None:
+            self.index = create_index(dimension=embeddings.shape[1], **self.index_config)
+        if self.index.is_trained:
+            with metrics.stage("index_add", vectors=len(embeddings)):
+                self.index.add(self._prepare_vectors(embeddings))
+            metrics.count("vectors_added", len(embeddings))
+        elif len(self.chunks) >= recommended_training_size(self.index):
+            self._train_index()
+
+    def _train_index(self):
+        # Vectors wait in the chunk store until there are enough of them to train on
+        sample = training_sample(self.chunks.vectors, max(recommended_training_size(self.index), MAX_TRAINING_SAMPLE))
+        with metrics.stage("index_train", vectors=len(sample)):
+            self.index.train(self._prepare_vectors(sample))
+        self.logger.info(f"Trained {self.index_config['index_type']} index on {len(sample)} vectors")
+        with metrics.stage("index_add", vectors=len(self.chunks)):
+            self._index_stored_vectors()
+
+    def _index_stored_vectors(self):
+        self.index.reset()
+        for start in range(0, len(self.chunks), MAX_TRAINING_SAMPLE):
+            self.index.add(self._prepare_vectors(self.chunks.vectors[start:start + MAX_TRAINING_SAMPLE]))
+
+    def finalize_index(self):
+        if self.index is None or self.index.is_trained or not len(self.chunks):
+            return
+        if len(self.chunks) >= minimum_training_size(self.index):
+            self._train_index()
+            self.mark_changed()
+        else:
+            self.logger.info(f"Only {len(self.chunks)} vectors, searching exactly until the index can be trained")
+
+    def _search(self, query_embeddings: np.ndarray, top_k: int, allowed: np.ndarray = None):
+        queries = self._prepare_vectors(query_embeddings)
+        inner_product = uses_inner_product(self.index_config["index_type"])
+        with metrics.stage("search", queries=len(queries), top_k=top_k):
+            if allowed is not None and (self.index.ntotal < len(self.chunks) or len(allowed) <= EXACT_SEARCH_LIMIT):
+                vectors = self._prepare_vectors(self.chunks.vectors[allowed])
+                distances, positions = exact_search(vectors, queries, top_k, inner_product)
+                return distances, np.where(positions >= 0, allowed[np.maximum(positions, 0)], -1)
+            if self.index.ntotal < len(self.chunks):
+                return exact_search(self._prepare_vectors(self.chunks.vectors), queries, top_k, inner_product)
+
+            if allowed is None:
+                set_search_params(self.index, nprobe=self.nprobe, ef_search=self.ef_search)
+                return self.index.search(queries, top_k)
+            params, selector = filtered_search_params(self.index, allowed, nprobe=self.nprobe, ef_search=self.ef_search)
+            return self.index.search(queries, top_k, params=params)
+
+    def load_index(self) -> bool:
+        import faiss
+
+        index_path = os.path.join(self.index_dir, "index.faiss")
+        documents_path = os.path.join(self.index_dir, "documents.json")
+        if not (os.path.exists(index_path) and os.path.exists(documents_path)):
+            return False
+
+        try:
+            index = faiss.read_index(index_path)
+            chunks = ChunkStore.load(self.index_dir)
+            with open(documents_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except Exception as e:
+            self.logger.warning(f"Could not load index {self.index_name}, rebuilding: {e}")
+            return False
+
+        if manifest.get("model") != self.embedding_key:
+            self.logger.warning(f"Saved index {self.index_name} does not match the current model, rebuilding")
+            return False
+
+        self.index = index
+        self.chunks = chunks
+        self.sparse = self.load_sparse_index(chunks)
+        self.duplicates = self.load_duplicate_index(chunks)
+        self.documents = manifest.get("documents", {})
+        self.index_version = manifest.get("version") or self.index_version
+        if chunks.vector_dtype != self.vector_dtype:
+            chunks.convert_vectors(self.vector_dtype)
+            self.mark_changed()
+
+        # The chunk store keeps every vector, so a different index type is rebuilt without re-embedding
+        stale = index.is_trained and index.ntotal != len(chunks)
+        if manifest.get("index") != self.index_config or stale:
+            self.logger.info(f"Rebuilding index {self.index_name} as {self.index_config['index_type']}")
+            self.index = create_index(dimension=index.d, **self.index_config)
+            if self.index.is_trained:
+                self._index_stored_vectors()
+            self.finalize_index()
+            self.mark_changed()
+        return True
+
+    def load_sparse_index(self, chunks: ChunkStore) -> SparseIndex:
+        try:
+            sparse = SparseIndex.load(self.index_dir)
+            if len(sparse) == len(chunks):
+                return sparse
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Could not load the sparse index of {self.index_name}: {e}")
+
+        # Postings only need the stored chunk text, so indexes saved without them are upgraded in place
+        self.logger.info(f"Rebuilding the sparse index of {self.index_name} from {len(chunks)} stored chunks")
+        sparse = SparseIndex()
+        for start in range(0, len(chunks), MAX_TRAINING_SAMPLE):
+            sparse.add([chunks.text(i) for i in range(start, min(start + MAX_TRAINING_SAMPLE, len(chunks)))])
+        self.mark_changed()
+        return sparse
+
+    def load_duplicate_index(self, chunks: ChunkStore) -> DuplicateIndex:
+        try:
+            duplicates = DuplicateIndex.load(self.index_dir, self.dedup_threshold)
+            if len(duplicates) == len(chunks):
+                return duplicates
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning(f"Could not load the duplicate signatures of {self.index_name}: {e}")
+
+        self.logger.info(f"Rebuilding the duplicate signatures of {self.index_name} from {len(chunks)} stored chunks")
+        duplicates = DuplicateIndex(self.dedup_threshold)
+        for start in range(0, len(chunks), MAX_TRAINING_SAMPLE):
+            texts = [chunks.text(i) for i in range(start, min(start + MAX_TRAINING_SAMPLE, len(chunks)))]
+            duplicates.add(np.vstack([duplicates.signature(text) for text in texts]))
+        self.mark_changed()
+        return duplicates
+
+    def save_index(self):
+        if not self.dirty or self.index is None:
+            return
+        import faiss
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        index_path = os.path.join(self.index_dir, "index.faiss")
+        documents_path = os.path.join(self.index_dir, "documents.json")
+
+        # Write to temporary files first so an interrupted save never leaves a half-written index
+        faiss.write_index(self.index, index_path + ".tmp")
+        self.chunks.save(self.index_dir)
+        self.sparse.save(self.index_dir)
+        self.duplicates.save(self.index_dir)
+        with open(documents_path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump({"model": self.embedding_key, "index": self.index_config, "version": self.index_version,
+                       "documents": self.documents}, file)
+        os.replace(index_path + ".tmp", index_path)
+        os.replace(documents_path + ".tmp", documents_path)
+        self.dirty = False
+
+    def mark_changed(self):
+        self.dirty = True
+        self.index_version = uuid.uuid4().hex
+
+    def file_hash(self, file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def remove_documents(self, file_paths: List[str]):
+        removed = set(file_paths) & set(self.documents)
+        while removed:
+            affected = (self._remove_sources(removed) & set(self.documents)) - removed
+            for file_path in removed:
+                del self.documents[file_path]
+                self.logger.info(f"Removed {file_path} from index {self.index_name}")
+
+            # Their aliased text went with the removed chunks, so they are dropped and ingested again
+            for file_path in affected:
+                self.logger.info(f"Re-ingesting {file_path}: it aliased chunks of a removed document")
+            self.reingest |= affected
+            removed = affected
+
+    def _remove_sources(self, sources) -> set:
+        keep = self.chunks.remove_sources(list(sources))
+        affected = self.duplicates.remove(keep, set(sources))
+        self.mark_changed()
+        if keep.all():
+            return affected
+
+        self.sparse.remove(keep)
+        # reset() keeps an IVF index's trained quantizer, so the survivors can be re-added directly
+        if self.index is not None and self.index.is_trained:
+            self._index_stored_vectors()
+        return affected
+
+    def report_progress(self, event: str, **fields):
+        if self.progress is not None:
+            self.progress({"event": event, **fields})
+
+    def sync_documents(self, file_paths: List[str], workers: int = None, prune: bool = True, save: bool = True):
+        # prune=False keeps documents that are not listed, for indexes shared by several document sets
+        workers = workers or self.ingest_workers
+        self.report_progress("ingest_start", files=len(file_paths))
+        if prune:
+            self.remove_documents([path for path in self.documents if path not in file_paths])
+        if workers > 1 and len(file_paths) > 1:
+            self.process_documents_parallel(file_paths, workers)
+        else:
+            for file_path in file_paths:
+                self.process_document(file_path)
+        while self.reingest:
+            # Without pruning, unlisted documents stay in the index, so those that lost aliased chunks are re-ingested too
+            stale, self.reingest = sorted(path for path in self.reingest if not prune or path in file_paths), set()
+            for file_path in stale:
+                self.process_document(file_path)
+        self.finalize_index()
+        if save:
+            self.save_index()
+        if self.embedding_cache is not None:
+            self.logger.info(f"Embedding cache: {self.embedding_cache.stats()}")
+        if self.duplicates.enabled:
+            self.logger.info(f"Near-duplicate chunks: {self.dedup_stats()}")
+
+    def dedup_stats(self) -> Dict:
+        stored = sum(document["chunks"] for document in self.documents.values())
+        duplicates = sum(document.get("duplicates", 0) for document in self.documents.values())
+        return {
+            "threshold": self.dedup_threshold,
+            "chunks_seen": stored + duplicates,
+            "chunks_stored": stored,
+            "duplicates": duplicates,
+            "duplicate_rate": duplicates / (stored + duplicates) if stored + duplicates else 0.0,
+        }
+
+    def preprocess_stream(self, texts: Iterable[str]) -> Iterator[str]:
+        cleaned = preprocess_texts(texts, batch_size=self.nlp_batch_size, n_process=self.nlp_n_process)
+        return metrics.timed_iter("preprocess", cleaned)
 
     def preprocess_text(self, text: str) -> str:      
-        doc = nlp(text)
-        clean_text = " ".join([token.lemma_.lower() for token in doc if not token.is_stop and token.is_alpha])
-        return clean_text
+        return " ".join(self.preprocess_stream([text]))
+
+    def iter_document_pages(self, file_path: str) -> Iterator[str]:
+        return metrics.timed_iter("extract", iter_document_pages(file_path))
 
     def extract_text_from_file(self, file_path: str) -> str:
         try:
-            if file_path.lower().endswith('.pdf'):
-                with fitz.open(file_path) as pdf:
-                    text = " ".join([page.get_text() for page in pdf])
-                    return self.preprocess_text(text)
-            elif file_path.lower().endswith('.txt'):
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    text = file.read()
-                    return self.preprocess_text(text)
-            else:
-                self.logger.warning(f"Unsupported file type: {file_path}")
-                return ""
+            return " ".join(self.preprocess_stream(self.iter_document_pages(file_path)))
         except Exception as e:
             self.logger.error(f"Text extraction error for {file_path}: {e}")
             return ""
@@ -77,94 +548,436 @@ class AdvancedDocumentQA:
         return chunks
 
     def embed_text(self, text: str) -> np.ndarray:
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1).numpy()
-
-    def extract_keywords(self, text: str, top_n: int = 5) -> List[str]:
-        rake = Rake()
-        rake.extract_keywords_from_text(text)
-        return rake.get_ranked_phrases()[:top_n]
-
-    def weighted_score(self, query: str, text_chunk: str) -> float:
-        query_keywords = set(self.extract_keywords(query))
-        text_keywords = set(self.extract_keywords(text_chunk))
-        keyword_overlap = len(query_keywords & text_keywords) / len(query_keywords | text_keywords)
-
-        query_embedding = self.embed_text(query).flatten() 
-        text_embedding = self.embed_text(text_chunk).flatten()  
-        semantic_similarity = np.dot(query_embedding, text_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(text_embedding))
-
-        return 0.7 * semantic_similarity + 0.3 * keyword_overlap
+        return self.embed_texts([text])
+
+    def embed_texts(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        if self.embedding_cache is None or not texts:
+            return self._encode(texts, batch_size)
+
+        cached = self.embedding_cache.get_many(texts)
+        metrics.count("embedding_cache_hits", len(cached))
+        metrics.count("embedding_cache_misses", len(texts) - len(cached))
+        missing = list(dict.fromkeys(text for i, text in enumerate(texts) if i not in cached))
+        if missing:
+            encoded = self._encode(missing, batch_size)
+            self.embedding_cache.put_many(missing, encoded)
+            encoded_by_text = dict(zip(missing, encoded))
+            cached.update({i: encoded_by_text[text] for i, text in enumerate(texts) if i not in cached})
+        return np.vstack([cached[i] for i in range(len(texts))]).astype(np.float32)
+
+    def _encode(self, texts: List[str], batch_size: int = None) -> np.ndarray:
+        import torch
+
+        batch_size = batch_size or self.batch_size
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            with metrics.stage("tokenize", texts=len(batch)):
+                with self.model_lock:
+                    inputs = self.tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=512)
+            with metrics.stage("embed", texts=len(batch)), torch.no_grad():
+                outputs = self.model(**inputs)
+            metrics.count("embedded_texts", len(batch))
+            metrics.count("embedding_tokens", int(inputs["attention_mask"].sum()))
+            # Mean-pool over real tokens only so padding does not dilute shorter chunks
+            mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            summed = (outputs.last_hidden_state * mask).sum(dim=1)
+            counts = mask.sum(dim=1).clamp(min=1e-9)
+            embeddings.append((summed / counts).numpy())
+        if not embeddings:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.vstack(embeddings).astype(np.float32)
+
+    def weighted_scores(self, query_embeddings: np.ndarray, ids: np.ndarray, lexical_scores) -> np.ndarray:
+        # Fuses dense and BM25 relevance for the (questions x candidates) id matrix in one pass. Candidate
+        # vectors and postings were stored at ingest, so no extra forward passes are needed. Missing hits score -inf.
+        valid = (ids >= 0) & (ids < len(self.chunks))
+        safe_ids = np.where(valid, ids, 0)
+
+        vectors = np.asarray(self.chunks.vectors[safe_ids.ravel()], dtype=np.float32).reshape(*ids.shape, -1)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+        queries = query_embeddings / np.maximum(np.linalg.norm(query_embeddings, axis=-1, keepdims=True), 1e-12)
+        semantic_similarity = np.einsum("qkd,qd->qk", vectors, queries)
+
+        # BM25 is unbounded, so each question's scores are scaled by its best lexical match
+        rows = np.broadcast_to(np.arange(len(ids))[:, None], ids.shape)
+        lexical = np.asarray(lexical_scores[rows.ravel(), safe_ids.ravel()], dtype=np.float32).reshape(ids.shape)
+        best = lexical_scores.max(axis=1).toarray().astype(np.float32)
+        lexical /= np.where(best > 0, best, 1.0)
+
+        scores = 0.7 * semantic_similarity + 0.3 * lexical
+        scores[~valid] = -np.inf
+        return scores
+
+    def changed_hash(self, file_path: str) -> str:
+        # Returns the content hash when the file needs (re-)ingesting, otherwise None. Raises OSError if unreadable.
+        doc_hash = self.file_hash(file_path)
+        if self.documents.get(file_path, {}).get("hash") == doc_hash:
+            self.logger.info(f"Skipping {file_path}: unchanged since last run")
+            return None
+        return doc_hash
 
     def process_document(self, file_path: str):
-        text = self.extract_text_from_file(file_path)
-        chunks = self.chunk_text(text)
-        embeddings = [self.embed_text(chunk) for chunk in chunks]
+        self.report_progress("file_start", file=file_path)
+        try:
+            doc_hash = self.changed_hash(file_path)
+        except OSError as e:
+            self.logger.error(f"Could not read {file_path}: {e}")
+            self.report_progress("file_done", file=file_path, error=str(e))
+            return
+        if doc_hash is None:
+            self.report_progress("file_done", file=file_path, skipped=True)
+            return
+
+        # Pages are parsed, cleaned and chunked in a background thread while earlier chunks are embedded
+        pages = self.iter_document_pages(file_path)
+        chunks = metrics.timed_iter("chunk", iter_chunks(self.preprocess_stream(pages)))
+        self.ingest_chunks(file_path, doc_hash, prefetch(chunks, maxsize=self.batch_size * 4))
+
+    def process_documents_parallel(self, file_paths: List[str], workers: int):
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        pending = []
+        for path in dict.fromkeys(file_paths):
+            try:
+                doc_hash = self.changed_hash(path)
+            except OSError as e:
+                self.logger.error(f"Could not read {path}: {e}")
+                self.report_progress("file_done", file=path, error=str(e))
+                continue
+            if doc_hash is None:
+                self.report_progress("file_done", file=path, skipped=True)
+            else:
+                pending.append((path, doc_hash))
+        if not pending:
+            return
+
+        # Workers only extract and preprocess; results are consumed in submission order so the
+        # single writer below assigns the same chunk positions as a sequential run. At most
+        # 2 * workers documents are in flight, and each one's text is released once ingested.
+        workers = min(workers, len(pending))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            submissions = iter(pending)
+            in_flight = deque()
+
+            def submit_next():
+                document = next(submissions, None)
+                if document is not None:
+                    in_flight.append((*document, executor.submit(extract_document, document[0], self.nlp_batch_size)))
+
+            for _ in range(2 * workers):
+                submit_next()
+            try:
+                while in_flight:
+                    file_path, doc_hash, future = in_flight.popleft()
+                    submit_next()
+                    self.report_progress("file_start", file=file_path)
+                    try:
+                        with metrics.stage("extract_wait", file=file_path):
+                            texts = future.result()
+                    except Exception as e:
+                        self.logger.error(f"Text extraction error for {file_path}: {e}")
+                        self.report_progress("file_done", file=file_path, error=str(e))
+                        continue
+                    finally:
+                        del future
+                    self.ingest_chunks(file_path, doc_hash, metrics.timed_iter("chunk", iter_chunks(texts)))
+                    del texts
+            except JobCancelled:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def ingest_chunks(self, file_path: str, doc_hash: str, chunks: Iterable[str]):
+        self.remove_documents([file_path])
+        count = 0
+        duplicates = 0
 
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            vector_id = f"{file_path}_{i}"
-            self.metadata[vector_id] = {"text": chunk, "source": file_path}
-            self.index.add(np.array(embedding))
+        try:
+            for batch in batched(chunks, self.batch_size):
+                # Near-duplicates are dropped before embedding and recorded as aliases of the stored chunk
+                with metrics.stage("dedup", chunks=len(batch)):
+                    signatures, duplicate_of = self.duplicates.select(batch)
+                new = duplicate_of < 0
+                self.duplicates.add_aliases(file_path, duplicate_of[~new])
+                duplicates += int(np.count_nonzero(~new))
+                metrics.count("duplicate_chunks", int(np.count_nonzero(~new)))
+                batch = [chunk for chunk, keep in zip(batch, new) if keep]
+                if not batch:
+                    continue
+
+                embeddings = self.embed_texts(batch)
+
+                self.chunks.add(file_path, batch, embeddings)
+                with metrics.stage("sparse_add", chunks=len(batch)):
+                    self.sparse.add(batch)
+                self.duplicates.add(signatures[new])
+                self._add_vectors(embeddings)
+                count += len(batch)
+                metrics.count("chunks", len(batch))
+                self.report_progress("chunk_batch", file=file_path, chunks=count)
+        except JobCancelled:
+            self._remove_sources([file_path])
+            raise
+        except Exception as e:
+            self.logger.error(f"Text extraction error for {file_path}: {e}")
+            self._remove_sources([file_path])
+            self.report_progress("file_done", file=file_path, error=str(e))
+            return
 
-        self.logger.info(f"Processed {file_path}: {len(chunks)} chunks")
+        self.documents[file_path] = {"hash": doc_hash, "chunks": count, "duplicates": duplicates}
+        self.mark_changed()
+        metrics.count("documents")
+        self.report_progress("file_done", file=file_path, chunks=count, duplicates=duplicates)
+        self.logger.info(f"Processed {file_path}: {count} chunks, {duplicates} near-duplicates skipped")
 
     def query_and_extract_info(self, question: str, top_k: int = 5) -> Dict:
-        query_embedding = self.embed_text(question).reshape(1, -1)
-        distances, indices = self.index.search(query_embedding, top_k)
-        results = []
-
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx < len(self.metadata):
-                vector_id = list(self.metadata.keys())[idx]
-                text_chunk = self.metadata[vector_id]["text"]
-                score = self.weighted_score(question, text_chunk)
+        return self.query_batch([question], top_k)[0]
+
+    def query_batch(self, questions: List[str], top_k: int = 5, sources: Iterable[str] = None) -> List[Dict]:
+        # sources restricts the answers to chunks of those documents, including chunks they share as aliases
+        if self.index is None or not len(self.chunks) or not questions:
+            return [{"query": question, "results": []} for question in questions]
+        sources = None if sources is None else sorted(set(sources))
+        if self.query_cache is None:
+            return self._query_batch(questions, top_k, sources)
+
+        params = {"model": self.embedding_key, "index": self.index_config, "nprobe": self.nprobe,
+                  "ef_search": self.ef_search, "sources": sources}
+        version = self.index_version
+        keys = [self.query_cache.key(question, top_k, version, params) for question in questions]
+        with metrics.stage("query_cache", queries=len(questions)):
+            cached = self.query_cache.get_many(keys, version)
+        metrics.count("query_cache_hits", len(cached))
+        metrics.count("query_cache_misses", len(questions) - len(cached))
+
+        missing = [i for i in range(len(questions)) if i not in cached]
+        if missing:
+            answers = self._query_batch([questions[i] for i in missing], top_k, sources)
+            self.query_cache.put_many([keys[i] for i in missing], [answer["results"] for answer in answers], version)
+            cached.update({i: answer["results"] for i, answer in zip(missing, answers)})
+        return [{"query": question, "results": cached[i]} for i, question in enumerate(questions)]
+
+    def _query_batch(self, questions: List[str], top_k: int, sources: List[str] = None) -> List[Dict]:
+        allowed, aliases = None, {}
+        if sources is not None:
+            aliases = self.duplicates.aliases_for(set(sources))
+            allowed = np.union1d(self.chunks.ids_for(sources), np.fromiter(aliases, dtype=np.int64, count=len(aliases)))
+            if not len(allowed):
+                return [{"query": question, "results": []} for question in questions]
+
+        # One forward pass and one index search for every question in the batch
+        query_embeddings = self.embed_texts(questions, batch_size=max(len(questions), self.batch_size))
+        distances, dense_ids = self._search(query_embeddings, top_k, allowed)
+
+        # Questions are lemmatised like the chunks so their terms line up with the postings
+        with metrics.stage("sparse_search", queries=len(questions), top_k=top_k):
+            lexical_scores = self.sparse.scores(lemmatize_queries(questions, self.nlp_batch_size))
+            assert lexical_scores.shape[0] == len(questions)
+            if allowed is not None:
+                from scipy.sparse import diags
+
+                mask = np.zeros(len(self.chunks), dtype=np.float32)
+                mask[allowed] = 1
+                lexical_scores = (lexical_scores @ diags(mask)).tocsr()
+                lexical_scores.eliminate_zeros()
+            sparse_ids = SparseIndex.top_k(lexical_scores, top_k)
+
+        # Candidates are the union of both retrievers; ids found by both are kept once
+        indices = np.sort(np.concatenate([dense_ids, sparse_ids], axis=1), axis=1)
+        indices[:, 1:][indices[:, 1:] == indices[:, :-1]] = -1
+        with metrics.stage("rerank", queries=len(questions)):
+            scores = self.weighted_scores(query_embeddings, indices, lexical_scores)
+        metrics.count("queries", len(questions))
+
+        all_results = []
+        for question, row_ids, row_scores in zip(questions, indices, scores):
+            results = []
+            for col in np.argsort(-row_scores, kind="stable")[:top_k]:
+                if not np.isfinite(row_scores[col]):
+                    continue
+                text_chunk, source = self.chunks.get(int(row_ids[col]))
+                if sources is not None and source not in sources:
+                    source = aliases[int(row_ids[col])]
                 results.append({
                     "text": text_chunk,
-                    "source": self.metadata[vector_id]["source"],
-                    "score": score
+                    "source": source,
+                    "score": row_scores[col]
                 })
-
-        results = sorted(results, key=lambda x: x["score"], reverse=True)[:top_k]
-        return {"query": question, "results": results}
+            all_results.append({"query": question, "results": results})
+        return all_results
 
     def fine_tune_model(self, dataset_path: str):
         # Example placeholder for fine-tuning if labeled data is available
         pass
 
-def main():
-    INDEX_NAME = 'advanced-document-qa'
-    input_data = sys.stdin.read()
-
+def run_job(qa_system: AdvancedDocumentQA, data: Dict, progress=None) -> List[Dict]:
+    qa_system.progress = progress
     try:
-        data = ast.literal_eval(input_data)
-    except Exception as e:
-        print(f"Input parsing error: {e}")
-        return
+        return _run_job(qa_system, data)
+    finally:
+        qa_system.progress = None
 
+
+def _run_job(qa_system: AdvancedDocumentQA, data: Dict) -> List[Dict]:
     uploaded_files = data.get("uploaded_files", [])
     questions = data.get("questions", "").split('\n')
 
-    try:
-        qa_system = AdvancedDocumentQA(INDEX_NAME)
+    with metrics.stage("ingest", files=len(uploaded_files)):
+        qa_system.sync_documents(uploaded_files, workers=data.get("workers"))
+
+    questions = [question for question in questions if question.strip()]
+    all_extracted_info = []
+    qa_system.report_progress("questions_start", questions=len(questions))
+
+    # Each batch of answers is written out as soon as it is ready instead of after the whole job.
+    # report_dir lets a client have the worker write the report next to it rather than in the worker's directory.
+    report_dir = data.get("report_dir", "")
+    report_paths = [os.path.join(report_dir, path) for path in (REPORT_TEXT_PATH, REPORT_JSONL_PATH, REPORT_JSON_PATH)]
+    with ReportWriter(*report_paths) as writer:
+        for batch in batched(questions, QUERY_BATCH_SIZE):
+            for info in qa_system.query_batch(batch):
+                with metrics.stage("report_write"):
+                    writer.write(info)
+                all_extracted_info.append(info)
+                qa_system.report_progress("question", query=info["query"], done=len(all_extracted_info),
+                                          total=len(questions))
+
+    if qa_system.query_cache is not None:
+        qa_system.logger.info(f"Query cache: {qa_system.query_cache.stats()}")
+    return all_extracted_info
+
+
+def watch_for_cancel(stream) -> threading.Event:
+    # Any further line on the stream, or the parent closing it, asks the running job to stop
+    cancel = threading.Event()
 
-        for file_path in uploaded_files:
-            qa_system.process_document(file_path)
+    def watch():
+        stream.readline()
+        cancel.set()
 
-        all_extracted_info = []
+    threading.Thread(target=watch, daemon=True).start()
+    return cancel
 
-        for question in questions:
-            if question.strip():
-                results = qa_system.query_and_extract_info(question)
-                all_extracted_info.append(results)
-                print(f"Question: {question}")
 
-        #print(all_extracted_info)
-        Generate_Main(all_extracted_info)
+def run_batch(args):
+    from batch import BatchRunner
 
+    if args.metrics:
+        metrics.enable(tracing=args.trace)
+    qa_system = AdvancedDocumentQA(
+        INDEX_NAME, index_type=args.index_type, nlist=args.nlist, nprobe=args.nprobe, ef_search=args.ef_search,
+        fast_embedding=args.fast_embedding, num_threads=args.threads,
+        vector_dtype="float16" if args.float16_vectors else "float32", dedup_threshold=args.dedup_threshold,
+        ingest_workers=args.workers or 1, query_cache_path=QUERY_CACHE_PATH if args.query_cache else None)
+    stats = BatchRunner(qa_system, top_k=args.top_k).run(args.batch, args.output, args.concurrency, args.resume)
+    if args.metrics:
+        metrics.write_json(args.metrics)
+    print(f"Batch finished: {stats['completed']} completed, {stats['failed']} failed, "
+          f"{stats['skipped']} skipped; results in {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer questions about a set of documents")
+    parser.add_argument("--local", action="store_true", help="run in this process instead of the resident worker")
+    parser.add_argument("--index-type", choices=list(INDEX_TYPES), default="flat", help="FAISS index type (implies --local)")
+    parser.add_argument("--nlist", type=int, default=256,
+                        help="inverted lists of an IVF index, used when the index is created (implies --local)")
+    parser.add_argument("--nprobe", type=int, default=16,
+                        help="IVF lists visited per query; higher is more accurate and slower (implies --local)")
+    parser.add_argument("--ef-search", type=int, default=64,
+                        help="HNSW candidate list size per query; higher is more accurate and slower (implies --local)")
+    parser.add_argument("--fast-embedding", action="store_true", help="embed with an int8-quantized model (implies --local)")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads used by torch (implies --local)")
+    parser.add_argument("--float16-vectors", action="store_true", help="store chunk vectors as float16 (implies --local)")
+    parser.add_argument("--dedup-threshold", type=float, default=0.9,
+                        help="similarity at which chunks count as near-duplicates; 0 disables deduplication "
+                             "(implies --local)")
+    parser.add_argument("--query-cache", action="store_true",
+                        help="also keep query results on disk between runs (implies --local)")
+    parser.add_argument("--workers", type=int, default=None, help="processes used to extract documents in parallel")
+    parser.add_argument("--metrics", metavar="PATH", help="write per-stage timings and counters to this JSON file")
+    parser.add_argument("--trace", action="store_true", help="also record tracing spans in the metrics file")
+    parser.add_argument("--progress", action="store_true", help="print progress events as JSON lines on stdout")
+    parser.add_argument("--stdin-control", action="store_true",
+                        help="read the job from the first line of stdin and stop it cleanly when another line "
+                             "or the end of stdin follows")
+    parser.add_argument("--batch", metavar="JOBS", help="run every job in this JSON Lines file instead of reading stdin")
+    parser.add_argument("--output", default=BATCH_OUTPUT_PATH, help="JSON Lines file receiving one record per batch job")
+    parser.add_argument("--concurrency", type=int, default=1, help="batch jobs processed at the same time")
+    parser.add_argument("--resume", action="store_true", help="skip batch jobs that already succeeded in --output")
+    parser.add_argument("--top-k", type=int, default=5, help="results returned per question in batch mode")
+    args = parser.parse_args()
+
+    if args.batch:
+        run_batch(args)
+        return
+
+    input_data = sys.stdin.readline() if args.stdin_control else sys.stdin.read()
+
+    try:
+        data = ast.literal_eval(input_data)
+    except Exception as e:
+        print(f"Input parsing error: {e}")
+        return
+
+    # The worker runs in its own directory, so files are resolved here and the report comes back here
+    data["uploaded_files"] = [os.path.abspath(path) for path in data.get("uploaded_files", [])]
+    data["report_dir"] = os.getcwd()
+    if args.workers:
+        data["workers"] = args.workers
+    if args.metrics:
+        data["metrics"] = True
+        data["trace"] = args.trace
+        # Only used when the job runs in this process; a worker records the job's metrics itself
+        metrics.enable(tracing=args.trace)
+
+    local_options = [name for name in LOCAL_OPTIONS if getattr(args, name) != parser.get_default(name)]
+    if local_options and not args.local:
+        print(f"Running locally: the worker cannot apply {', '.join(local_options)}", file=sys.stderr)
+
+    cancel = watch_for_cancel(sys.stdin) if args.stdin_control else None
+
+    def progress(event: Dict):
+        # Cancelling from here stops the job between files or batches, never in the middle of saving the index
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled()
+        if args.progress:
+            print(json.dumps(event), flush=True)
+
+    try:
+        response = None
+        if not (args.local or local_options):
+            response = worker.submit_job(data, on_event=progress if args.progress else None,
+                                         should_cancel=cancel.is_set if cancel is not None else None)
+        if response is None:
+            all_extracted_info = run_job(AdvancedDocumentQA(
+                INDEX_NAME, index_type=args.index_type, nlist=args.nlist, nprobe=args.nprobe, ef_search=args.ef_search,
+                fast_embedding=args.fast_embedding, num_threads=args.threads,
+                vector_dtype="float16" if args.float16_vectors else "float32", dedup_threshold=args.dedup_threshold,
+                query_cache_path=QUERY_CACHE_PATH if args.query_cache else None), data, progress)
+            if args.metrics:
+                metrics.write_json(args.metrics)
+        elif response.get("cancelled"):
+            print("Cancelled")
+            return
+        elif response.get("ok"):
+            all_extracted_info = response["results"]
+            if args.metrics and "metrics" in response:
+                with open(args.metrics, 'w', encoding='utf-8') as file:
+                    json.dump(response["metrics"], file, indent=2)
+        else:
+            print(f"Error: {response.get('error')}")
+            return
+
+        for info in all_extracted_info:
+            print(f"Question: {info['query']}")
+
+    except JobCancelled:
+        print("Cancelled")
     except Exception as e:
         print(f"Error: {e}")
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,8 @@ import logging
 import json
 import numpy as np
 import os
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
-import torch
+
+from metrics import metrics
 
 
 def numpy_serializer(obj):
@@ -14,34 +14,97 @@ def numpy_serializer(obj):
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
 
-def Generate_Main(all_extracted_info):
-    try:
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
+REPORT_TEXT_PATH = "generated_report.txt"
+REPORT_JSONL_PATH = "generated_report.jsonl"
+REPORT_JSON_PATH = "generated_report.json"
+
+
+def format_report_block(info):
+    lines = [f"Query: {info.get('query', 'No query')}\n"]
+    for result in info.get('results', []):
+        score = float(result.get('score', 'N/A')) if hasattr(result.get('score'), '__float__') else result.get('score')
+        lines.append(f"Relevant Snippet (Score: {score}): {result.get('text', '')}\n")
+    lines.append("\n---\n\n")
+    return "".join(lines)
+
+
+def atomic_write(path, text):
+    with open(path + ".tmp", "w", encoding='utf-8') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_report(path):
+    # JSON Lines reports may end in a partially written record if the writer was interrupted
+    with open(path, 'r', encoding='utf-8') as file:
+        if not path.endswith(".jsonl"):
+            return json.load(file)
+        report = []
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            report.append(json.loads(line))
+        return report
+
+
+def rebuild_json_report(jsonl_path=REPORT_JSONL_PATH, json_path=REPORT_JSON_PATH):
+    report = load_report(jsonl_path)
+    atomic_write(json_path, json.dumps(report, indent=2, default=numpy_serializer))
+    return report
 
-        report_text = ""
-        for info in all_extracted_info:
-            query = info.get('query', 'No query')
-            report_text += f"Query: {query}\n"
 
-            for result in info.get('results', []):
-                score = float(result.get('score', 'N/A')) if hasattr(result.get('score'), '__float__') else result.get('score')
-                report_text += f"Relevant Snippet (Score: {score}): {result.get('text', '')}\n"
+class ReportWriter:
+    # Appends each query's results to the JSON Lines and text reports as soon as they are available
+    def __init__(self, text_path=REPORT_TEXT_PATH, jsonl_path=REPORT_JSONL_PATH, json_path=REPORT_JSON_PATH):
+        self.text_path = text_path
+        self.jsonl_path = jsonl_path
+        self.json_path = json_path
+        self.count = 0
 
-            report_text += "\n---\n\n"
+        # Replace any previous report in one step, then only ever append whole records
+        atomic_write(text_path, "")
+        atomic_write(jsonl_path, "")
+        self.text_file = open(text_path, "a", encoding='utf-8')
+        self.jsonl_file = open(jsonl_path, "a", encoding='utf-8')
 
-        output_report_filepath = "generated_report.txt"
-        with open(output_report_filepath, "w", encoding='utf-8') as file:
-            file.write(report_text)
+    def write(self, info):
+        self._append(self.jsonl_file, json.dumps(info, default=numpy_serializer) + "\n")
+        self._append(self.text_file, format_report_block(info))
+        self.count += 1
 
-        output_json_filepath = "generated_report.json"
-        with open(output_json_filepath, "w", encoding='utf-8') as file:
-            json.dump(all_extracted_info, file, indent=2, default=numpy_serializer)
+    def _append(self, file, data):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
 
-        logger.info(f"Report generated and saved to {output_report_filepath}")
-        logger.info(f"JSON report saved to {output_json_filepath}")
+    def close(self, write_json=True):
+        self.text_file.close()
+        self.jsonl_file.close()
+        if write_json and self.json_path:
+            rebuild_json_report(self.jsonl_path, self.json_path)
 
-        return report_text
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def Generate_Main(all_extracted_info):
+    try:
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger(__name__)
+
+        with ReportWriter() as writer:
+            for info in all_extracted_info:
+                writer.write(info)
+
+        logger.info(f"Report generated and saved to {REPORT_TEXT_PATH}")
+        logger.info(f"JSON report saved to {REPORT_JSON_PATH}")
+
+        return "".join(format_report_block(info) for info in all_extracted_info)
 
     except Exception as e:
         logging.error(f"Error generating report: {e}")
@@ -50,8 +113,7 @@ def Generate_Main(all_extracted_info):
 
 def format_report(json_file):
     try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            report = json.load(f)
+        report = load_report(json_file)
 
         answers = []
         for query_block in report:
@@ -71,59 +133,229 @@ def format_report(json_file):
         print(f"Error formatting report: {e}")
 
 
-def generate_paragraph_answers(json_file):
-    try:
-        model_name = "gpt2"
-        model = GPT2LMHeadModel.from_pretrained(model_name)
-        tokenizer = GPT2Tokenizer.from_pretrained(model_name)
-
-        with open(json_file, 'r', encoding='utf-8') as f:
-            report = json.load(f)
-
-        paragraph_responses = []
-        for query_block in report:
-            query = query_block.get("query", "No query found")
-            results = query_block.get("results", [])
-            context = " ".join(result.get("text", "").strip() for result in results)
-
-            if context:
-                input_text = f"""
+GENERATION_MODEL = "gpt2"
+PROMPT_TEMPLATE = """
                 **Question:** {query}
                 **Context:** {context}
                 **Task:** Based on the provided context, please answer the question in a well-structured, comprehensive, and grammatically correct paragraph. 
                 Ensure the response is coherent, clear, and free of errors. The answer should be complete and logically consistent, summarizing the key points from the context.
                 """
 
-                inputs = tokenizer.encode(input_text, return_tensors="pt", max_length=1024, truncation=True)
-                attention_mask = torch.ones(inputs.shape, dtype=torch.long)
-                output = model.generate(
-                    inputs, attention_mask=attention_mask, pad_token_id=tokenizer.eos_token_id,
-                    max_length=1024, num_return_sequences=1, num_beams=2, no_repeat_ngram_size=2, early_stopping=True
+
+class TokenStreamer:
+    # Implements the put/end interface model.generate() drives; the first put() carries the prompt
+    def __init__(self, tokenizer, on_token, offset, batch_size):
+        self.tokenizer = tokenizer
+        self.on_token = on_token
+        self.offset = offset
+        self.tokens = [[] for _ in range(batch_size)]
+        self.emitted = [""] * batch_size
+        self.finished = [False] * batch_size
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.finished[row]:
+                continue
+            if token == self.tokenizer.eos_token_id:
+                self.finished[row] = True
+                continue
+            self.tokens[row].append(token)
+            # Decode the whole answer so far so multi-token characters are emitted only once complete
+            text = self.tokenizer.decode(self.tokens[row], skip_special_tokens=True)
+            if len(text) > len(self.emitted[row]) and not text.endswith("\ufffd"):
+                self.on_token(self.offset + row, text[len(self.emitted[row]):])
+                self.emitted[row] = text
+
+    def end(self):
+        pass
+
+
+class AnswerGenerator:
+    def __init__(self, model_name: str = GENERATION_MODEL, max_new_tokens: int = 128, batch_size: int = 4,
+                 fast: bool = False):
+        self.model_name = model_name
+        self.max_new_tokens = max_new_tokens
+        self.batch_size = batch_size
+        self.fast = fast
+        self.model = None
+        self.tokenizer = None
+        self.logger = logging.getLogger(__name__)
+
+    def load(self):
+        if self.model is not None:
+            return
+        from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+        self.model = GPT2LMHeadModel.from_pretrained(self.model_name)
+        self.model.eval()
+        self.tokenizer = GPT2Tokenizer.from_pretrained(self.model_name)
+        # GPT-2 has no pad token; left padding keeps every prompt flush against its generated tokens
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        self.logger.info(f"Loaded generation model {self.model_name}")
+
+    def build_prompt(self, query, context):
+        # Trim the context, not the instructions, so prompt plus answer fit in the model's window
+        budget = self.model.config.n_positions - self.max_new_tokens
+        overhead = len(self.tokenizer.encode(PROMPT_TEMPLATE.format(query=query, context="")))
+        context_ids = self.tokenizer.encode(context)[:max(budget - overhead, 0)]
+        return PROMPT_TEMPLATE.format(query=query, context=self.tokenizer.decode(context_ids))
+
+    def generate(self, prompts, on_token=None, fast=None):
+        import time
+        import torch
+
+        self.load()
+        fast = self.fast if fast is None else fast
+        if fast:
+            options = {"do_sample": False, "num_beams": 1}
+        else:
+            options = {"num_beams": 2, "no_repeat_ngram_size": 2, "early_stopping": True}
+
+        answers = []
+        stats = []
+        for start in range(0, len(prompts), self.batch_size):
+            batch = prompts[start:start + self.batch_size]
+            max_prompt = self.model.config.n_positions - self.max_new_tokens
+            inputs = self.tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=max_prompt)
+
+            # transformers only streams greedy/sampled decoding; beam answers are delivered whole
+            streamer = TokenStreamer(self.tokenizer, on_token, start, len(batch)) if on_token and fast else None
+
+            started = time.perf_counter()
+            with metrics.stage("generate", prompts=len(batch)), torch.no_grad():
+                output = self.model.generate(
+                    **inputs, pad_token_id=self.tokenizer.eos_token_id, max_new_tokens=self.max_new_tokens,
+                    num_return_sequences=1, streamer=streamer, **options
                 )
+            elapsed = time.perf_counter() - started
+            metrics.count("prompt_tokens", int(inputs["attention_mask"].sum()))
+
+            sequences = []
+            for sequence in output[:, inputs["input_ids"].shape[1]:].tolist():
+                if self.tokenizer.eos_token_id in sequence:
+                    sequence = sequence[:sequence.index(self.tokenizer.eos_token_id)]
+                sequences.append(sequence)
+            batch_tokens = sum(len(sequence) for sequence in sequences)
+
+            for row, sequence in enumerate(sequences):
+                answer = self.tokenizer.decode(sequence, skip_special_tokens=True).strip()
+                if on_token and streamer is None:
+                    on_token(start + row, answer)
+                answers.append(answer)
+                metrics.count("generated_tokens", len(sequence))
+                # Rows of a batch are decoded together, so timing is only known for the batch as a whole
+                stats.append({"tokens": len(sequence), "batch_size": len(batch), "batch_latency": elapsed,
+                              "batch_tokens_per_sec": batch_tokens / elapsed if elapsed else 0.0})
+
+        return answers, stats
+
+
+_generator = None
 
-                answer = tokenizer.decode(output[0], skip_special_tokens=True).strip()
-                response = f"**Question:** {query}\n**Answer:** {answer}\n"
 
-                # Remove everything before * * **Questions:*
-                response = response[response.find("* * **Questions:*"):]
-                paragraph_responses.append(response)
+def get_generator(**kwargs) -> AnswerGenerator:
+    # One resident generator per process so GPT-2 is loaded once, not on every call
+    global _generator
+    if _generator is None:
+        _generator = AnswerGenerator(**kwargs)
+    return _generator
 
-            else:
-                response = f"**Question:** {query}\n**Answer:** No relevant information found.\n"
-                response = response[response.find("* * **Questions:*"):]
-                paragraph_responses.append(response)
+
+def answer_report(report, fast=False, max_new_tokens=128, batch_size=4, on_token=None):
+    # One paragraph per query block, plus generation stats for the blocks that had context to answer from.
+    # Uses the process's resident generator, so a worker serving many reports loads GPT-2 once.
+    generator = get_generator()
+    generator.load()
+    generator.max_new_tokens = max_new_tokens
+    generator.batch_size = batch_size
+
+    queries = [query_block.get("query", "No query found") for query_block in report]
+    contexts = [" ".join(result.get("text", "").strip() for result in query_block.get("results", []))
+                for query_block in report]
+    pending = [i for i, context in enumerate(contexts) if context]
+
+    prompts = [generator.build_prompt(queries[i], contexts[i]) for i in pending]
+    answers, stats = generator.generate(prompts, on_token=on_token, fast=fast)
+
+    paragraph_responses = [f"**Question:** {query}\n**Answer:** No relevant information found.\n" for query in queries]
+    for i, answer, stat in zip(pending, answers, stats):
+        paragraph_responses[i] = f"**Question:** {queries[i]}\n**Answer:** {answer}\n"
+        stat["question"] = i
+    return paragraph_responses, stats
+
+
+def generate_paragraph_answers(json_file, fast=False, max_new_tokens=128, batch_size=4, stream=False, local=False):
+    try:
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger(__name__)
+        batch_size = 1 if stream else batch_size
+        report = load_report(json_file)
+
+        on_token = None
+        if stream:
+            on_token = lambda position, text: print(text, end="", flush=True)
+            print("Streaming answers...")
+
+        # A running worker keeps the generation model loaded between calls; otherwise it is loaded here
+        response = None
+        if not local:
+            import worker
+
+            on_event = (lambda event: on_token(event["position"], event["text"])) if stream else None
+            response = worker.submit_job({"report": report, "fast": fast, "max_new_tokens": max_new_tokens,
+                                          "batch_size": batch_size, "stream": stream}, on_event=on_event, op="generate")
+        if response is None:
+            paragraph_responses, stats = answer_report(report, fast, max_new_tokens, batch_size, on_token)
+        elif response.get("ok"):
+            paragraph_responses, stats = response["answers"], response["stats"]
+        else:
+            print(f"Error generating paragraph answers: {response.get('error')}")
+            return []
+        if stream:
+            print()
+
+        for stat in stats:
+            logger.info(f"Question {stat['question'] + 1}: {stat['tokens']} tokens (batch of {stat['batch_size']}: "
+                        f"{stat['batch_latency']:.2f}s, {stat['batch_tokens_per_sec']:.1f} tokens/sec)")
+
+        if stats:
+            total_tokens = sum(stat["tokens"] for stat in stats)
+            total_time = sum(stat["batch_latency"] for stat in stats[::batch_size])
+            logger.info(f"Generated {total_tokens} tokens for {len(stats)} questions in {total_time:.2f}s "
+                        f"({total_tokens / total_time if total_time else 0.0:.1f} tokens/sec)")
 
         for response in paragraph_responses:
             print(response)
 
+        return paragraph_responses
+
     except Exception as e:
         print(f"Error generating paragraph answers: {e}")
+        return []
+
+
+if __name__ == "__main__":
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Write paragraph answers for a generated report")
+    parser.add_argument("input_file", nargs="?", default="generated_report.json")
+    parser.add_argument("--fast", action="store_true", help="greedy decoding instead of beam search")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="print answers as they are generated (implies --fast)")
+    parser.add_argument("--local", action="store_true", help="generate in this process instead of the resident worker")
+    args = parser.parse_args()
 
-input_file = "generated_report.json"
+    input_file = args.input_file
 
-if os.path.exists(input_file):
-    print("Generating paragraph answers...")
-    generate_paragraph_answers(input_file)
-else:
-    print(f"Input file '{input_file}' not found. Please ensure the report is generated.")
\ No newline at end of file
+    if os.path.exists(input_file):
+        print("Generating paragraph answers...")
+        generate_paragraph_answers(input_file, fast=args.fast or args.stream, max_new_tokens=args.max_new_tokens,
+                                   batch_size=args.batch_size, stream=args.stream, local=args.local)
+    else:
+        print(f"Input file '{input_file}' not found. Please ensure the report is generated.")
@@ -0,0 +1,104 @@
+import numpy as np
+
+# "-ip" variants search by inner product over L2-normalised vectors, i.e. cosine similarity
+INDEX_TYPES = {
+    "flat": "Flat",
+    "ivf-flat": "IVF{nlist},Flat",
+    "ivf-pq": "IVF{nlist},PQ{pq_m}",
+    "hnsw": "HNSW{hnsw_m}",
+}
+INDEX_TYPES.update({f"{name}-ip": spec for name, spec in list(INDEX_TYPES.items())})
+
+# faiss warns below 39 training points per IVF list; PQ needs 256 points per 8-bit codebook
+TRAINING_POINTS_PER_LIST = 39
+PQ_CENTROIDS = 256
+
+
+def uses_inner_product(index_type: str) -> bool:
+    return index_type.endswith("-ip")
+
+
+def create_index(index_type: str, dimension: int, nlist: int = 256, pq_m: int = 16, hnsw_m: int = 32):
+    import faiss
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+    if "PQ" in INDEX_TYPES[index_type] and dimension % pq_m:
+        raise ValueError(f"pq_m={pq_m} must divide the vector dimension {dimension}")
+
+    spec = INDEX_TYPES[index_type].format(nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    metric = faiss.METRIC_INNER_PRODUCT if uses_inner_product(index_type) else faiss.METRIC_L2
+    return faiss.index_factory(dimension, spec, metric)
+
+
+def minimum_training_size(index) -> int:
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return 0
+    # try_extract_index_ivf hands back the IndexIVF base class; only the downcast reveals the PQ variant
+    if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ):
+        return max(ivf.nlist, PQ_CENTROIDS)
+    return ivf.nlist
+
+
+def recommended_training_size(index) -> int:
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return 0
+    return max(minimum_training_size(index), TRAINING_POINTS_PER_LIST * ivf.nlist)
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if nprobe and ivf is not None:
+        ivf.nprobe = nprobe
+    if ef_search and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def filtered_search_params(index, ids: np.ndarray, nprobe: int = None, ef_search: int = None):
+    # Search parameters that only admit the given ids. The selector is returned as well because
+    # faiss does not keep it alive, so callers must hold on to it until the search has run.
+    import faiss
+
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+    if faiss.try_extract_index_ivf(index) is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or faiss.try_extract_index_ivf(index).nprobe)
+    elif hasattr(index, "hnsw"):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, selector
+
+
+def training_sample(vectors: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    if len(vectors) <= size:
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(len(vectors), size=size, replace=False))
+    return np.ascontiguousarray(vectors[rows], dtype=np.float32)
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int, inner_product: bool = False):
+    # Brute-force fallback with faiss' (distances, labels) layout, used while an index is untrained
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if inner_product:
+        scores = queries @ vectors.T
+        order = np.argsort(-scores, axis=1)[:, :k]
+    else:
+        scores = (queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)
+        order = np.argsort(scores, axis=1)[:, :k]
+
+    distances = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+    labels = order.astype(np.int64)
+    if labels.shape[1] < k:
+        pad = k - labels.shape[1]
+        labels = np.pad(labels, ((0, 0), (0, pad)), constant_values=-1)
+        distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+    return distances, labels
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, metrics: "Metrics", name: str, attributes: Dict = None, span: bool = True):
+        self.metrics = metrics
+        self.name = name
+        self.attributes = attributes or {}
+        self.span = span and metrics.tracing
+        self.child_seconds = 0.0
+
+    def __enter__(self):
+        stack = self.metrics._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        self.metrics._stack().pop()
+        # Self time excludes nested stages, so streaming stages that pull from each other are not double counted
+        if self.parent is not None:
+            self.parent.child_seconds += seconds
+        self.metrics._record(self, seconds, seconds - self.child_seconds, error=exc_type is not None)
+        return False
+
+
+class Metrics:
+    # Per-stage timers, counters and optional tracing spans. Disabled instances hand out a shared
+    # no-op context manager and return iterators untouched, so instrumented code pays almost nothing.
+    def __init__(self, enabled: bool = False, tracing: bool = False):
+        self.enabled = enabled
+        self.tracing = tracing
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+            self.spans = []
+            self.started = time.perf_counter()
+
+    def enable(self, tracing: bool = False):
+        self.enabled = True
+        self.tracing = self.tracing or tracing
+
+    @contextmanager
+    def recording(self, tracing: bool = False):
+        # Collects a fresh set of metrics for one job, then restores the previous settings so a long-lived
+        # process does not keep timing (and accumulating spans) after the job that asked for it
+        previous = self.enabled, self.tracing
+        self.enabled, self.tracing = True, tracing
+        self.reset()
+        try:
+            yield self
+        finally:
+            self.enabled, self.tracing = previous
+            if not self.enabled:
+                self.reset()
+
+    def add_hook(self, hook: Callable[[Dict], None]):
+        self.hooks.append(hook)
+
+    def stage(self, name: str, **attributes):
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name, attributes)
+
+    def timed_iter(self, name: str, items: Iterable) -> Iterator:
+        if not self.enabled:
+            return iter(items)
+        return self._timed_iter(name, iter(items))
+
+    def _timed_iter(self, name: str, items: Iterator) -> Iterator:
+        while True:
+            with _Stage(self, name, span=False):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.started,
+                "stages": {name: dict(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters),
+                "spans": list(self.spans) if self.tracing else [],
+            }
+
+    def write_json(self, path: str) -> Dict:
+        summary = self.summary()
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        os.replace(path + ".tmp", path)
+        self._emit({"type": "summary", **summary})
+        return summary
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _record(self, stage: _Stage, seconds: float, self_seconds: float, error: bool):
+        with self.lock:
+            timer = self.timers.setdefault(stage.name, {"calls": 0, "seconds": 0.0, "self_seconds": 0.0})
+            timer["calls"] += 1
+            timer["seconds"] += seconds
+            timer["self_seconds"] += self_seconds
+
+            if not stage.span:
+                return
+            event = {
+                "type": "span",
+                "name": stage.name,
+                "start": stage.wall_start,
+                "seconds": seconds,
+                "parent": stage.parent.name if stage.parent is not None else None,
+                "thread": threading.current_thread().name,
+                "error": error,
+                **stage.attributes,
+            }
+            self.spans.append(event)
+        self._emit(event)
+
+    def _emit(self, event: Dict):
+        for hook in self.hooks:
+            hook(event)
+
+
+metrics = Metrics(enabled=os.environ.get("RITERAI_METRICS") == "1", tracing=os.environ.get("RITERAI_TRACE") == "1")
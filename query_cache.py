@@ -0,0 +1,156 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from embedding_cache import normalize_text
+
+
+def json_default(obj):
+    # Scores come back from numpy as float32 scalars
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+class QueryCache:
+    # Query results keyed by sha256(normalised question, top_k, search parameters, index version), held in an
+    # in-memory LRU in front of an optional SQLite table. Entries of an older version of the same index (scope)
+    # are purged the first time a lookup sees a new version, so stale results are never served.
+    def __init__(self, scope: str, max_entries: int = 1024, path: str = None, max_disk_entries: int = 100000):
+        self.scope = scope
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+        self.conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                "key BLOB PRIMARY KEY, scope TEXT NOT NULL, version TEXT NOT NULL, results TEXT NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS queries_last_used ON queries (last_used)")
+            self.conn.commit()
+
+    def key(self, question: str, top_k: int, version: str, params: Dict) -> bytes:
+        scope = json.dumps({"scope": self.scope, "question": normalize_text(question).lower(), "top_k": top_k,
+                            "version": version, "params": params}, sort_keys=True)
+        return hashlib.sha256(scope.encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes], version: str) -> Dict[int, List[Dict]]:
+        found = {}
+        with self.lock:
+            self._set_version(version)
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[i] = self.entries[key]
+
+            missing = {}
+            for i, key in enumerate(keys):
+                if i not in found:
+                    missing.setdefault(key, []).append(i)
+            if self.conn is not None and missing:
+                batch, loaded = list(missing), []
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(batch), 500):
+                    chunk = batch[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self.conn.execute(
+                        f"SELECT key, results FROM queries WHERE version = ? AND key IN ({placeholders})",
+                        [version, *chunk],
+                    ).fetchall()
+                    for key, results in rows:
+                        results = json.loads(results)
+                        self._remember(key, results)
+                        found.update({i: results for i in missing[key]})
+                        loaded.append(key)
+
+                if loaded:
+                    now = time.time()
+                    self.conn.executemany("UPDATE queries SET last_used = ? WHERE key = ?",
+                                          [(now, key) for key in loaded])
+                    self.conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        # Callers annotate results in place, so never hand out the cached objects themselves
+        return {i: copy.deepcopy(results) for i, results in found.items()}
+
+    def put_many(self, keys: List[bytes], results: List[List[Dict]], version: str):
+        if not keys:
+            return
+        with self.lock:
+            self._set_version(version)
+            encoded = [json.dumps(value, default=json_default) for value in results]
+            for key, value in zip(keys, encoded):
+                self._remember(key, json.loads(value))
+
+            if self.conn is not None:
+                now = time.time()
+                self.conn.executemany("INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                                      [(key, self.scope, version, value, now) for key, value in zip(keys, encoded)])
+                self._evict()
+                self.conn.commit()
+
+    def _remember(self, key: bytes, results: List[Dict]):
+        self.entries[key] = results
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _set_version(self, version: str):
+        if version == self.version:
+            return
+        if self.version is not None:
+            self.invalidations += 1
+        self.version = version
+        self.entries.clear()
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM queries WHERE scope = ? AND version != ?", (self.scope, version))
+            self.conn.commit()
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM queries").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM queries WHERE key IN (SELECT key FROM queries ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def stats(self) -> Dict:
+        with self.lock:
+            disk_entries = None
+            if self.conn is not None:
+                (disk_entries,) = self.conn.execute("SELECT COUNT(*) FROM queries WHERE scope = ?",
+                                                    (self.scope,)).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "disk_entries": disk_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
@@ -0,0 +1,175 @@
+import json
+import os
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+from chunk_store import append_rows, in_memory
+
+SPARSE_FILES = ["sparse_vocabulary.json", "sparse_indptr.npy", "sparse_term_ids.npy", "sparse_counts.npy"]
+
+
+def tokenize(text: str) -> List[str]:
+    # Chunks go through preprocess_texts and questions through lemmatize_queries, so lemmas are already lower-cased and space separated
+    return text.split()
+
+
+class SparseIndex:
+    # BM25 postings over the lemmatised chunk text. Row i of the term-count matrix is chunk i, the same
+    # position it has in the chunk store and the FAISS index, so both retrievers share candidate ids.
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: List[str] = []
+        self.vocabulary = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.term_ids = np.zeros(0, dtype=np.int32)
+        self.counts = np.zeros(0, dtype=np.int32)
+        self._weights = None
+
+    def __len__(self) -> int:
+        return self.rows
+
+    # The postings are over-allocated by add(); these views cover only the stored rows and entries
+    @property
+    def indptr(self) -> np.ndarray:
+        return self._indptr[:self.rows + 1]
+
+    @indptr.setter
+    def indptr(self, indptr: np.ndarray):
+        self._indptr = indptr
+        self.rows = len(indptr) - 1
+
+    @property
+    def term_ids(self) -> np.ndarray:
+        return self._term_ids[:self._indptr[self.rows]]
+
+    @term_ids.setter
+    def term_ids(self, term_ids: np.ndarray):
+        self._term_ids = term_ids
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts[:self._indptr[self.rows]]
+
+    @counts.setter
+    def counts(self, counts: np.ndarray):
+        self._counts = counts
+
+    def term_id(self, term: str) -> int:
+        if term not in self.vocabulary:
+            self.vocabulary[term] = len(self.terms)
+            self.terms.append(term)
+        return self.vocabulary[term]
+
+    def add(self, texts: List[str]):
+        if not texts:
+            return
+        term_ids, counts, lengths = [], [], []
+        for text in texts:
+            row = Counter(self.term_id(term) for term in tokenize(text))
+            term_ids.extend(row.keys())
+            counts.extend(row.values())
+            lengths.append(len(row))
+
+        entries = int(self._indptr[self.rows])
+        self._term_ids = append_rows(self._term_ids, entries, np.asarray(term_ids, dtype=np.int32))
+        self._counts = append_rows(self._counts, entries, np.asarray(counts, dtype=np.int32))
+        self._indptr = append_rows(self._indptr, self.rows + 1, entries + np.cumsum(lengths, dtype=np.int64))
+        self.rows += len(texts)
+        self._weights = None
+
+    def remove(self, keep: np.ndarray):
+        if keep.all():
+            return
+        row_lengths = np.diff(self.indptr)
+        entries = np.repeat(keep, row_lengths)
+        # indptr goes last: the term_ids and counts views are cut at its final entry
+        self.term_ids = self.term_ids[entries]
+        self.counts = self.counts[entries]
+        self.indptr = np.concatenate([[0], np.cumsum(row_lengths[keep])]).astype(np.int64)
+        self._weights = None
+
+    def weights(self):
+        # terms x chunks matrix of BM25 term weights, rebuilt lazily after the postings change
+        if self._weights is None:
+            from scipy.sparse import csr_matrix
+
+            row_lengths = np.diff(self.indptr)
+            counts = self.counts.astype(np.float32)
+            doc_lengths = np.bincount(np.repeat(np.arange(len(self)), row_lengths), weights=counts, minlength=len(self))
+            average_length = doc_lengths.mean() if len(self) and doc_lengths.mean() else 1.0
+
+            document_frequency = np.bincount(self.term_ids, minlength=len(self.terms))
+            idf = np.log1p((len(self) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths / average_length)
+            data = idf[self.term_ids] * counts * (self.k1 + 1) / (counts + np.repeat(norm, row_lengths))
+
+            matrix = csr_matrix((data, self.term_ids, self.indptr), shape=(len(self), len(self.terms)))
+            self._weights = matrix.T.tocsr()
+        return self._weights
+
+    def scores(self, queries: List[str]):
+        # queries x chunks sparse matrix of BM25 scores; unknown query terms contribute nothing
+        from scipy.sparse import csr_matrix
+
+        rows, columns, counts = [], [], []
+        for row, query in enumerate(queries):
+            terms = Counter(self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary)
+            rows.extend([row] * len(terms))
+            columns.extend(terms.keys())
+            counts.extend(terms.values())
+        query_matrix = csr_matrix((np.asarray(counts, dtype=np.float32), (rows, columns)),
+                                  shape=(len(queries), len(self.terms)))
+        return (query_matrix @ self.weights()).tocsr()
+
+    @staticmethod
+    def top_k(scores, k: int) -> np.ndarray:
+        # Best k chunk ids per row of a scores() matrix, padded with -1 like a FAISS search
+        ids = np.full((scores.shape[0], k), -1, dtype=np.int64)
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            data, columns = scores.data[start:end], scores.indices[start:end]
+            positive = data > 0
+            data, columns = data[positive], columns[positive]
+            if len(data) > k:
+                best = np.argpartition(-data, k - 1)[:k]
+                data, columns = data[best], columns[best]
+            order = np.argsort(-data, kind="stable")
+            ids[row, :len(order)] = columns[order]
+        return ids
+
+    def save(self, directory: str):
+        # Mapped postings are copied into memory first, as in ChunkStore.save
+        self._indptr, self._term_ids, self._counts = map(in_memory, (self._indptr, self._term_ids, self._counts))
+        os.makedirs(directory, exist_ok=True)
+        path = lambda name: os.path.join(directory, name)
+
+        with open(path("sparse_vocabulary.json.tmp"), 'w', encoding='utf-8') as file:
+            json.dump({"k1": self.k1, "b": self.b, "terms": self.terms}, file)
+        with open(path("sparse_indptr.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.indptr))
+        with open(path("sparse_term_ids.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.term_ids))
+        with open(path("sparse_counts.npy.tmp"), 'wb') as file:
+            np.save(file, np.asarray(self.counts))
+
+        for name in SPARSE_FILES:
+            os.replace(path(name + ".tmp"), path(name))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "SparseIndex":
+        with open(os.path.join(directory, "sparse_vocabulary.json"), 'r', encoding='utf-8') as file:
+            vocabulary = json.load(file)
+        index = cls(k1=vocabulary["k1"], b=vocabulary["b"])
+        index.terms = vocabulary["terms"]
+        index.vocabulary = {term: i for i, term in enumerate(index.terms)}
+
+        mmap_mode = 'r' if mmap else None
+        index.indptr = np.load(os.path.join(directory, "sparse_indptr.npy"), mmap_mode=mmap_mode)
+        index.term_ids = np.load(os.path.join(directory, "sparse_term_ids.npy"), mmap_mode=mmap_mode)
+        index.counts = np.load(os.path.join(directory, "sparse_counts.npy"), mmap_mode=mmap_mode)
+        if index.indptr[-1] != len(index._term_ids) or len(index._term_ids) != len(index._counts):
+            raise ValueError(f"Sparse index in {directory} is inconsistent")
+        return index
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from batch import BatchRunner, completed_job_ids
+
+
+class FakeQA:
+    # Indexes every path except those listed as unreadable, reporting those like sync_documents does
+    def __init__(self, unreadable=()):
+        self.unreadable = set(unreadable)
+        self.documents = {}
+        self.progress = None
+        self.synced = []
+
+    def sync_documents(self, file_paths, prune=True, save=True):
+        self.synced.append(list(file_paths))
+        for path in file_paths:
+            if path in self.unreadable:
+                self.progress({"event": "file_done", "file": path, "error": "No such file"})
+            else:
+                self.documents[path] = {"chunks": 1}
+                self.progress({"event": "file_done", "file": path, "chunks": 1})
+
+    def query_batch(self, questions, top_k=5, sources=None):
+        return [{"query": question, "results": []} for question in questions]
+
+
+def test_job_with_an_unreadable_document_fails():
+    qa = FakeQA(unreadable={"missing.pdf"})
+    runner = BatchRunner(qa)
+    record = runner.run_job({"id": "a", "uploaded_files": ["ok.pdf", "missing.pdf"], "questions": ["Why?"]})
+    assert not record["ok"]
+    assert list(record["failed_files"]) == ["missing.pdf"]
+
+    # The unreadable document is not remembered as synced, so the next job retries it
+    record = runner.run_job({"id": "b", "uploaded_files": ["missing.pdf"], "questions": ["Why?"]})
+    assert not record["ok"]
+    assert qa.synced == [["ok.pdf", "missing.pdf"], ["missing.pdf"]]
+
+    record = runner.run_job({"id": "c", "uploaded_files": ["ok.pdf"], "questions": ["Why?"]})
+    assert record["ok"] and record["results"] == [{"query": "Why?", "results": []}]
+
+
+def test_completed_job_ids_skips_corrupt_and_partial_lines(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text("\n".join([
+        json.dumps({"id": "a", "ok": True}),
+        "{not json",
+        json.dumps(["not", "a", "record"]),
+        json.dumps({"id": "b", "ok": False}),
+        json.dumps({"id": "c", "ok": True}),
+    ]) + "\n" + '{"id": "d", "o', encoding="utf-8")
+
+    assert completed_job_ids(str(path)) == {"a", "c"}
+    assert path.read_text(encoding="utf-8").endswith('"ok": true}\n')
+
+
+def test_missing_file_is_reported_by_sync_documents(monkeypatch, tmp_path):
+    import extract
+
+    monkeypatch.setattr(extract, "INDEX_ROOT", str(tmp_path))
+    monkeypatch.setattr(extract.AdvancedDocumentQA, "load_index", lambda self: False)
+    qa = extract.AdvancedDocumentQA("test", embedding_cache=None, query_cache_size=0)
+    record = BatchRunner(qa).run_job({"id": "a", "uploaded_files": [str(tmp_path / "missing.pdf")],
+                                      "questions": ["Why?"]})
+    assert not record["ok"]
+    assert list(record["failed_files"]) == [str(tmp_path / "missing.pdf")]
@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from chunk_store import ChunkStore
+
+
+def vectors_for(start, count, dimension=4):
+    return np.arange(start * dimension, (start + count) * dimension, dtype=np.float32).reshape(count, dimension)
+
+
+def filled_store():
+    store = ChunkStore()
+    for i in range(40):
+        source = f"doc{i % 3}.pdf"
+        store.add(source, [f"chunk {i} a", f"chunk {i} b"], vectors_for(2 * i, 2))
+    return store
+
+
+def test_add_keeps_chunks_in_order():
+    store = filled_store()
+    assert len(store) == 80
+    assert store.vectors.shape == (80, 4)
+    assert store.get(7) == ("chunk 3 b", "doc0.pdf")
+    assert np.array_equal(store.vectors, vectors_for(0, 80))
+    assert store.count("doc1.pdf") == 26
+    # Spare capacity is never visible
+    assert len(store.source_ids) == len(store) and len(store.offsets) == len(store) + 1
+
+
+def test_remove_sources_compacts_everything():
+    store = filled_store()
+    keep = store.remove_sources(["doc1.pdf"])
+    assert keep.sum() == len(store) == 54
+    assert store.sources == ["doc0.pdf", "doc2.pdf"]
+    assert store.get(2) == ("chunk 2 a", "doc2.pdf")
+    assert np.array_equal(store.vectors, vectors_for(0, 80)[keep])
+
+    store.add("doc3.pdf", ["new"], vectors_for(0, 1))
+    assert store.get(54) == ("new", "doc3.pdf")
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, mmap):
+    store = filled_store()
+    store.save(str(tmp_path))
+    loaded = ChunkStore.load(str(tmp_path), mmap=mmap)
+    assert len(loaded) == 80
+    assert [loaded.get(i) for i in range(80)] == [store.get(i) for i in range(80)]
+    assert np.array_equal(loaded.vectors, store.vectors)
+
+    # Saving over the loaded files must not keep them mapped, which Windows refuses to replace
+    loaded.save(str(tmp_path))
+    assert not any(isinstance(array, np.memmap) for array in (loaded._source_ids, loaded._offsets, loaded._vectors))
+    assert isinstance(loaded.text_buffer, bytearray)
+
+    loaded.add("doc9.pdf", ["after load"], vectors_for(0, 1))
+    assert loaded.get(80) == ("after load", "doc9.pdf")
+    loaded.save(str(tmp_path))
+    assert ChunkStore.load(str(tmp_path), mmap=mmap).get(80) == ("after load", "doc9.pdf")
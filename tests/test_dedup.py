@@ -0,0 +1,48 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from dedup import DuplicateIndex
+
+TEXT = "quarterly revenue grew by twelve percent driven by strong demand in the european market"
+
+
+def test_duplicates_are_found_within_and_across_batches():
+    index = DuplicateIndex(0.9)
+    signatures, duplicate_of = index.select([TEXT, "an unrelated paragraph about the weather today", TEXT])
+    assert duplicate_of.tolist() == [-1, -1, 0]
+
+    index.add(signatures[duplicate_of < 0])
+    _, duplicate_of = index.select([TEXT, "another new paragraph on something else entirely"])
+    assert duplicate_of.tolist() == [0, -1]
+    assert len(index) == 2
+
+
+def test_removing_a_chunk_reports_the_documents_aliasing_it():
+    index = DuplicateIndex(0.9)
+    signatures, _ = index.select([TEXT, "an unrelated paragraph about the weather today"])
+    index.add(signatures)
+    index.add_aliases("b.pdf", np.array([0]))
+    index.add_aliases("c.pdf", np.array([1]))
+
+    affected = index.remove(np.array([False, True]), {"a.pdf"})
+    assert affected == {"b.pdf"}
+    assert index.aliases == [(0, "c.pdf")]
+    assert len(index) == 1
+    # The surviving chunk is still found at its new id
+    _, duplicate_of = index.select(["an unrelated paragraph about the weather today"])
+    assert duplicate_of.tolist() == [0]
+
+
+def test_save_load_round_trip(tmp_path):
+    index = DuplicateIndex(0.9)
+    for i in range(20):
+        signatures, _ = index.select([f"{TEXT} number {i} " + " ".join(["word"] * i)])
+        index.add(signatures)
+    index.add_aliases("b.pdf", np.array([3]))
+    index.save(str(tmp_path))
+
+    loaded = DuplicateIndex.load(str(tmp_path), 0.9)
+    assert len(loaded) == 20
+    assert np.array_equal(loaded.signatures, index.signatures)
+    assert loaded.aliases_for({"b.pdf"}) == {3: "b.pdf"}
@@ -0,0 +1,40 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+from index_factory import create_index, minimum_training_size, recommended_training_size
+
+
+def test_ivf_pq_needs_a_full_codebook_even_with_few_lists():
+    index = create_index("ivf-pq", dimension=16, nlist=4, pq_m=4)
+    assert minimum_training_size(index) == 256
+    assert recommended_training_size(index) == 256
+
+    vectors = np.random.default_rng(0).standard_normal((minimum_training_size(index), 16)).astype(np.float32)
+    index.train(vectors)
+    assert index.is_trained
+
+
+def test_ivf_flat_needs_one_point_per_list():
+    assert minimum_training_size(create_index("ivf-flat", dimension=16, nlist=4)) == 4
+    assert minimum_training_size(create_index("flat", dimension=16)) == 0
+
+
+def test_finalize_index_waits_for_enough_ivf_pq_training_points(monkeypatch, tmp_path):
+    import extract
+
+    monkeypatch.setattr(extract, "INDEX_ROOT", str(tmp_path))
+    qa = extract.AdvancedDocumentQA("test", index_type="ivf-pq", nlist=4, pq_m=4, embedding_cache=None,
+                                    query_cache_size=0, dedup_threshold=0)
+    vectors = np.random.default_rng(0).standard_normal((73, 16)).astype(np.float32)
+    qa.chunks.add("doc.pdf", [f"chunk {i}" for i in range(73)], vectors)
+    qa._add_vectors(vectors)
+    qa.finalize_index()
+    assert not qa.index.is_trained
+
+    more = np.random.default_rng(1).standard_normal((200, 16)).astype(np.float32)
+    qa.chunks.add("doc.pdf", [f"more {i}" for i in range(200)], more)
+    qa._add_vectors(more)
+    qa.finalize_index()
+    assert qa.index.is_trained and qa.index.ntotal == 273
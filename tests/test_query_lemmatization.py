@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+import extract
+from sparse_index import SparseIndex
+
+STOP_WORDS = {"who", "are", "you", "why", "is", "the", "a", "of"}
+
+
+class FakeNlp:
+    # Stands in for spaCy: lemma is the lower-cased word, stop words and non-alphabetic tokens are flagged
+    def pipe(self, texts, batch_size=16, n_process=1):
+        for text in texts:
+            words = text.replace("?", " ?").split()
+            yield [SimpleNamespace(lemma_=word.lower(), is_stop=word.lower() in STOP_WORDS, is_alpha=word.isalpha())
+                   for word in words]
+
+
+@pytest.fixture
+def nlp(monkeypatch):
+    monkeypatch.setattr(extract, "get_nlp", lambda: FakeNlp())
+
+
+def test_lemmatize_queries_keeps_one_entry_per_question(nlp):
+    queries = extract.lemmatize_queries(["Who are you?", "Why?", "2023?", "Revenue of the company"])
+    assert queries == ["", "", "", "revenue company"]
+
+
+def test_sparse_scores_have_a_row_for_empty_queries():
+    index = SparseIndex()
+    index.add(["revenue company", "profit margin"])
+    scores = index.scores(["", "revenue", ""])
+    assert scores.shape == (3, 2)
+    assert SparseIndex.top_k(scores, 2).tolist() == [[-1, -1], [0, -1], [-1, -1]]
+
+
+def test_query_batch_answers_stop_word_only_questions(nlp, monkeypatch, tmp_path):
+    monkeypatch.setattr(extract, "INDEX_ROOT", str(tmp_path))
+    monkeypatch.setattr(extract.AdvancedDocumentQA, "load_index", lambda self: False)
+    qa = extract.AdvancedDocumentQA("test", embedding_cache=None, query_cache_size=0, dedup_threshold=0)
+
+    texts = ["revenue company grow", "profit margin shrink", "weather sunny"]
+    vectors = np.eye(3, dtype=np.float32)
+    qa.chunks.add("report.pdf", texts, vectors)
+    qa.sparse.add(texts)
+    # An untrained index searches the stored vectors exactly
+    qa.index = SimpleNamespace(ntotal=0)
+    monkeypatch.setattr(qa, "embed_texts", lambda questions, batch_size=None: np.ones((len(questions), 3), np.float32))
+
+    questions = ["Who are you?", "What about revenue?", "Why?"]
+    answers = qa.query_batch(questions, top_k=2)
+    assert [answer["query"] for answer in answers] == questions
+    assert all(len(answer["results"]) == 2 for answer in answers)
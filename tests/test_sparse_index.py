@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+from sparse_index import SparseIndex
+
+TEXTS = ["revenue grow quarter", "profit margin", "revenue revenue forecast", "weather", "margin call"]
+
+
+def test_batched_adds_match_a_single_add():
+    single = SparseIndex()
+    single.add(TEXTS)
+    batched = SparseIndex()
+    for text in TEXTS:
+        batched.add([text])
+
+    assert len(batched) == len(TEXTS)
+    assert np.array_equal(batched.indptr, single.indptr)
+    assert np.array_equal(batched.term_ids, single.term_ids)
+    assert np.array_equal(batched.counts, single.counts)
+    assert (batched.scores(["revenue margin"]) != single.scores(["revenue margin"])).nnz == 0
+
+
+def test_remove_then_add():
+    index = SparseIndex()
+    index.add(TEXTS)
+    index.remove(np.array([True, False, True, True, False]))
+    index.add(["profit forecast"])
+    assert len(index) == 4
+    assert SparseIndex.top_k(index.scores(["revenue", "profit"]), 1).tolist() == [[1], [3]]
+
+
+def test_save_load_round_trip(tmp_path):
+    index = SparseIndex()
+    index.add(TEXTS)
+    index.save(str(tmp_path))
+    loaded = SparseIndex.load(str(tmp_path))
+    loaded.save(str(tmp_path))
+    assert not any(isinstance(array, np.memmap) for array in (loaded._indptr, loaded._term_ids, loaded._counts))
+    loaded.add(["revenue"])
+    assert len(loaded) == len(TEXTS) + 1
+    assert SparseIndex.top_k(loaded.scores(["revenue"]), 3).tolist() == [[5, 2, 0]]
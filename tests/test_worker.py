@@ -0,0 +1,48 @@
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import pytest
+
+import worker
+
+AUTHKEY = b"test-key"
+
+
+@pytest.fixture
+def listener():
+    # Never accepting stands in for a worker that is busy with another client's job
+    with Listener(("127.0.0.1", 0), authkey=AUTHKEY) as listener:
+        yield listener
+
+
+def test_connecting_to_a_busy_worker_times_out(listener):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        worker.open_connection(listener.address, AUTHKEY, timeout=0.3)
+    assert time.monotonic() - start < 2
+    assert worker.request({"op": "ping"}, address=listener.address, authkey=AUTHKEY, timeout=0.3) is None
+
+
+def test_job_cancelled_while_waiting_for_a_busy_worker(listener):
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+    response = worker.submit_job({}, should_cancel=cancel.is_set, address=listener.address, authkey=AUTHKEY)
+    assert response == {"ok": False, "cancelled": True}
+
+
+def test_connection_is_returned_once_the_worker_accepts(listener):
+    accepted = []
+    thread = threading.Thread(target=lambda: accepted.append(listener.accept()))
+    thread.start()
+    conn = worker.open_connection(listener.address, AUTHKEY, timeout=5)
+    conn.send("hello")
+    thread.join()
+    assert accepted[0].recv() == "hello"
+    conn.close()
+    accepted[0].close()
+
+
+def test_index_names_cannot_leave_the_index_root():
+    assert worker.valid_index_name("advanced-document-qa")
+    assert not any(worker.valid_index_name(name) for name in ["..", ".hidden", "a/b", "a\\b", "", None])
@@ -0,0 +1,307 @@
+import argparse
+import logging
+import os
+import queue
+import re
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Dict, Optional
+
+# Keep this module free of heavy imports: the GUI and the extract.py CLI import it
+# just to talk to a running worker.
+WORKER_ADDRESS = ("127.0.0.1", int(os.environ.get("RITERAI_WORKER_PORT", "6543")))
+# Jobs are pickled, so only clients that can read this per-user, owner-only key file may connect.
+# A fresh key is written each time a worker starts.
+WORKER_KEY_PATH = os.environ.get("RITERAI_WORKER_KEY_PATH",
+                                 os.path.join(os.path.expanduser("~"), ".cache", "riterai", "worker.key"))
+PROTOCOL_VERSION = 3
+# Seconds the GUI waits for a worker to answer a ping or a shutdown before carrying on without it
+CONNECT_TIMEOUT = 2.0
+# Index names become directories under INDEX_ROOT, so path separators and leading dots are refused
+INDEX_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}")
+
+logger = logging.getLogger(__name__)
+
+
+def read_authkey(path: str = WORKER_KEY_PATH) -> Optional[bytes]:
+    if "RITERAI_WORKER_AUTHKEY" in os.environ:
+        return os.environ["RITERAI_WORKER_AUTHKEY"].encode()
+    try:
+        with open(path, 'rb') as file:
+            return file.read() or None
+    except OSError:
+        return None
+
+
+def new_authkey() -> bytes:
+    if "RITERAI_WORKER_AUTHKEY" in os.environ:
+        return os.environ["RITERAI_WORKER_AUTHKEY"].encode()
+    return secrets.token_hex(32).encode()
+
+
+def write_authkey(authkey: bytes, path: str = WORKER_KEY_PATH):
+    if "RITERAI_WORKER_AUTHKEY" in os.environ:
+        return
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    # Written under a temporary name created 0600 and then swapped in, so it is never readable by others
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(authkey)
+    os.replace(tmp_path, path)
+
+
+def valid_index_name(name) -> bool:
+    return isinstance(name, str) and INDEX_NAME_PATTERN.fullmatch(name) is not None
+
+
+class ConnectCancelled(Exception):
+    pass
+
+
+def open_connection(address, authkey: bytes, timeout: float = None, should_cancel: Callable[[], bool] = None):
+    # Client() has no timeout, and its handshake waits while the worker is busy with another client's job.
+    # The handshake therefore runs in a helper thread so the caller can give up on a timeout (TimeoutError)
+    # or a cancel (ConnectCancelled); a connection that completes after that is closed straight away.
+    outcome = queue.Queue()
+    lock = threading.Lock()
+    abandoned = threading.Event()
+
+    def connect():
+        try:
+            result = Client(address, authkey=authkey)
+        except Exception as e:
+            result = e
+        with lock:
+            if not abandoned.is_set():
+                outcome.put(result)
+            elif not isinstance(result, Exception):
+                result.close()
+
+    threading.Thread(target=connect, daemon=True).start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            result = outcome.get(timeout=0.1)
+            break
+        except queue.Empty:
+            cancelled = should_cancel is not None and should_cancel()
+            if not cancelled and (deadline is None or time.monotonic() < deadline):
+                continue
+            with lock:
+                if outcome.empty():
+                    abandoned.set()
+                    if cancelled:
+                        raise ConnectCancelled()
+                    raise TimeoutError(f"QA worker at {address} did not answer within {timeout}s")
+                result = outcome.get_nowait()
+                break
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def request(message: Dict, address=WORKER_ADDRESS, authkey: bytes = None, timeout: float = None) -> Optional[Dict]:
+    authkey = authkey or read_authkey()
+    if authkey is None:
+        return None
+    try:
+        with open_connection(address, authkey, timeout) as conn:
+            conn.send({"version": PROTOCOL_VERSION, **message})
+            return conn.recv()
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.debug(f"QA worker at {address} unavailable: {e}")
+        return None
+
+
+def ping(**kwargs) -> bool:
+    response = request({"op": "ping"}, **kwargs)
+    return bool(response and response.get("ok"))
+
+
+def submit_job(data: Dict, on_event: Callable[[Dict], None] = None, should_cancel: Callable[[], bool] = None,
+               address=WORKER_ADDRESS, authkey: bytes = None, op: str = "job") -> Optional[Dict]:
+    # Returns None when no worker is reachable so callers can fall back to one-shot mode.
+    # Progress events arrive ahead of the final response; a cancel request is sent at most once.
+    authkey = authkey or read_authkey()
+    if authkey is None:
+        return None
+    try:
+        conn = open_connection(address, authkey, should_cancel=should_cancel)
+    except ConnectCancelled:
+        return {"ok": False, "cancelled": True}
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.debug(f"QA worker at {address} unavailable: {e}")
+        return None
+
+    with conn:
+        try:
+            conn.send({"version": PROTOCOL_VERSION, "op": op, "data": data})
+            cancel_sent = False
+            while True:
+                if should_cancel is not None and not cancel_sent and should_cancel():
+                    conn.send({"op": "cancel"})
+                    cancel_sent = True
+                if not conn.poll(0.1):
+                    continue
+                message = conn.recv()
+                if "event" not in message:
+                    return message
+                if on_event is not None:
+                    on_event(message)
+        except (OSError, EOFError) as e:
+            logger.warning(f"Lost connection to the QA worker: {e}")
+            return {"ok": False, "error": f"Lost connection to the QA worker: {e}"}
+
+
+def shutdown(**kwargs) -> bool:
+    return request({"op": "shutdown"}, **kwargs) is not None
+
+
+def start_worker(wait: float = 0.0) -> Optional[subprocess.Popen]:
+    authkey = read_authkey()
+    if authkey is not None:
+        try:
+            open_connection(WORKER_ADDRESS, authkey, timeout=CONNECT_TIMEOUT).close()
+            return None
+        except TimeoutError:
+            # Running, but busy with another client's job
+            return None
+        except (OSError, EOFError, AuthenticationError):
+            pass
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline and process.poll() is None and not ping():
+        time.sleep(0.2)
+    return process
+
+
+def job_progress(conn):
+    from extract import JobCancelled
+
+    def progress(event: Dict):
+        # A client that disconnected mid-job is treated like a cancel so partial work is rolled back
+        try:
+            conn.send(event)
+            while conn.poll():
+                if conn.recv().get("op") == "cancel":
+                    raise JobCancelled()
+        except (OSError, EOFError):
+            raise JobCancelled()
+    return progress
+
+
+def handle(message: Dict, qa_systems: Dict, progress: Callable[[Dict], None] = None) -> Dict:
+    from extract import AdvancedDocumentQA, INDEX_NAME, JobCancelled, run_job
+
+    if message.get("version") != PROTOCOL_VERSION:
+        return {"ok": False, "error": f"Unsupported protocol version {message.get('version')}"}
+
+    op = message.get("op")
+    if op == "ping":
+        return {"ok": True, "pid": os.getpid()}
+    if op == "shutdown":
+        return {"ok": True}
+    if op == "job":
+        data = message.get("data", {})
+        index_name = data.get("index_name", INDEX_NAME)
+        if not valid_index_name(index_name):
+            return {"ok": False, "error": f"Invalid index name {index_name!r}"}
+        if index_name not in qa_systems:
+            qa_systems[index_name] = AdvancedDocumentQA(index_name)
+        from metrics import metrics
+
+        recording = metrics.recording(tracing=bool(data.get("trace"))) if data.get("metrics") else nullcontext()
+        try:
+            with recording:
+                response = {"ok": True, "results": run_job(qa_systems[index_name], data, progress)}
+                if data.get("metrics"):
+                    response["metrics"] = metrics.summary()
+        except JobCancelled:
+            logger.info("QA worker job cancelled")
+            return {"ok": False, "cancelled": True}
+        return response
+    if op == "generate":
+        from generate import answer_report
+
+        data = message.get("data", {})
+        on_token = None
+        if data.get("stream") and progress is not None:
+            on_token = lambda position, text: progress({"event": "token", "position": position, "text": text})
+        try:
+            answers, stats = answer_report(data.get("report", []), fast=bool(data.get("fast")),
+                                           max_new_tokens=int(data.get("max_new_tokens", 128)),
+                                           batch_size=int(data.get("batch_size", 4)), on_token=on_token)
+        except JobCancelled:
+            logger.info("QA worker generation cancelled")
+            return {"ok": False, "cancelled": True}
+        return {"ok": True, "answers": answers, "stats": stats}
+    return {"ok": False, "error": f"Unknown operation {op!r}"}
+
+
+def serve(address=WORKER_ADDRESS, authkey: bytes = None):
+    logging.basicConfig(level=logging.INFO)
+    # Load the models once up front so the first job does not pay the cold start
+    from extract import AdvancedDocumentQA, INDEX_NAME, get_nlp
+
+    qa_systems = {INDEX_NAME: AdvancedDocumentQA(INDEX_NAME)}
+    qa_systems[INDEX_NAME].model
+    get_nlp()
+    authkey = authkey or new_authkey()
+    with Listener(address, authkey=authkey) as listener:
+        # Published only once the port is ours, so a second worker cannot replace a running one's key
+        write_authkey(authkey)
+        logger.info(f"QA worker listening on {address[0]}:{address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError as e:
+                logger.warning(f"Rejected connection: {e}")
+                continue
+
+            with conn:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    continue
+
+                try:
+                    response = handle(message, qa_systems, job_progress(conn))
+                except Exception as e:
+                    logger.exception("QA worker job failed")
+                    response = {"ok": False, "error": str(e)}
+
+                try:
+                    conn.send(response)
+                except OSError as e:
+                    logger.warning(f"Client went away before the response was sent: {e}")
+
+            if message.get("op") == "shutdown":
+                logger.info("QA worker shutting down")
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident RiterAI question answering worker")
+    parser.add_argument("--ping", action="store_true", help="check whether a worker is running")
+    parser.add_argument("--stop", action="store_true", help="ask a running worker to exit")
+    args = parser.parse_args()
+
+    if args.ping:
+        sys.exit(0 if ping() else 1)
+    if args.stop:
+        sys.exit(0 if shutdown() else 1)
+    serve()
+
+
+if __name__ == "__main__":
+    main()